@@ -0,0 +1,68 @@
+import asyncio
+from contextlib import asynccontextmanager
+import asyncpg
+
+from .connection import (
+    DB_HOST, DB_NAME, DB_USER, DB_PASSWORD, DB_PORT,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_IDLE_TIMEOUT,
+)
+
+# asyncpg counterpart of connection.py, used by the async /chat pipeline.
+# Same DB_* / DB_POOL_* settings, but connections never block the event loop.
+
+_async_pool = None
+_async_pool_lock = asyncio.Lock()
+
+
+async def get_async_pool():
+    """Returns the process wide asyncpg pool, creating it on first use"""
+    global _async_pool
+    if _async_pool is None:
+        async with _async_pool_lock:
+            if _async_pool is None:
+                _async_pool = await asyncpg.create_pool(
+                    host=DB_HOST,
+                    database=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    port=DB_PORT,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    max_inactive_connection_lifetime=DB_POOL_IDLE_TIMEOUT,
+                )
+    return _async_pool
+
+
+@asynccontextmanager
+async def get_async_connection():
+    """
+    Async version of get_connection():
+
+        async with get_async_connection() as conn:
+            await conn.fetchrow(...)
+    """
+    pool = await get_async_pool()
+    async with pool.acquire(timeout=DB_POOL_TIMEOUT) as conn:
+        yield conn
+
+
+def get_async_pool_stats():
+    if _async_pool is None:
+        return {}
+    size = _async_pool.get_size()
+    idle = _async_pool.get_idle_size()
+    return {
+        "min_size": _async_pool.get_min_size(),
+        "max_size": _async_pool.get_max_size(),
+        "size": size,
+        "in_use": size - idle,
+        "idle": idle,
+        "utilisation": (size - idle) / _async_pool.get_max_size(),
+    }
+
+
+async def close_async_pool():
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
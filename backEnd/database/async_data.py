@@ -0,0 +1,68 @@
+import json
+from .async_connection import get_async_connection
+from .get_from_data import BEGIN_TURN_SQL, HISTORY_SQL, TurnNotStartedError, _turn_from_row, format_history
+from .id_cache import remember_turn_ids
+from .partitions import HISTORY_WINDOW_DAYS
+
+# Async versions of the hot path helpers in get_from_data.py / save_new_data.py.
+# The SQL is shared with the sync helpers, only the placeholders change.
+
+
+def _numbered(sql, names):
+    """Turns psycopg2 %(name)s placeholders into asyncpg $1, $2..."""
+    for position, name in enumerate(names, start=1):
+        sql = sql.replace(f'%({name})s', f'${position}')
+    return sql
+
+
+_BEGIN_TURN_PARAMS = ('user_identifier', 'chat_name', 'text', 'history_limit', 'service_name', 'history_days')
+BEGIN_TURN_SQL_ASYNC = _numbered(BEGIN_TURN_SQL, _BEGIN_TURN_PARAMS)
+_HISTORY_PARAMS = ('chat_id', 'history_days', 'exclude_message_id', 'limit')
+HISTORY_SQL_ASYNC = _numbered(HISTORY_SQL, _HISTORY_PARAMS)
+
+
+async def begin_turn_async(user_identifier, text, chat_name="WhatsApp_General", history_limit=10, service_name='google_calendar'):
+    """Async begin_turn(): same single statement, same return shape"""
+    args = (user_identifier, chat_name, text, history_limit, service_name, HISTORY_WINDOW_DAYS)
+    async with get_async_connection() as conn:
+        try:
+            row = await conn.fetchrow(BEGIN_TURN_SQL_ASYNC, *args)
+            if row is None:
+                # see begin_turn(): retry with a fresh snapshot
+                row = await conn.fetchrow(BEGIN_TURN_SQL_ASYNC, *args)
+        except Exception as e:
+            print(f"Error in begin_turn_async: {e}")
+            raise e
+
+    if row is None:
+        raise TurnNotStartedError(f"Could not start a turn for {user_identifier!r} in {chat_name!r}")
+    row = list(row)
+    # asyncpg hands json back as text
+    row[-1] = json.loads(row[-1])
+    turn = _turn_from_row(row)
+    remember_turn_ids(user_identifier, chat_name, turn['user_id'], turn['chat_id'])
+    return turn
+
+
+async def get_chat_history_async(chat_id, limit=10, exclude_message_id=None):
+    """Async get_chat_history_as_text()"""
+    async with get_async_connection() as conn:
+        rows = await conn.fetch(HISTORY_SQL_ASYNC, chat_id, HISTORY_WINDOW_DAYS, exclude_message_id, limit)
+    return format_history([(row['is_from_bot'], row['text']) for row in reversed(rows)])
+
+
+async def insert_message_async(text, is_from_bot, user_id, chat_id):
+    """Async insert_message(): returns the new message id or None"""
+    async with get_async_connection() as conn:
+        try:
+            return await conn.fetchval(
+                """
+                INSERT INTO messages (text, is_from_bot, user_id, chat_id, created_at) 
+                VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP) 
+                RETURNING id;
+                """,
+                text, is_from_bot, user_id, chat_id
+            )
+        except Exception as e:
+            print(f"Error inserting message: {e}")
+            return None
@@ -0,0 +1,214 @@
+from psycopg2.extras import Json, execute_values
+from .connection import get_connection
+
+# Local mirror of the users' Google Calendar events.
+# Rows are written only by services.calendar_sync (and by the insert tools,
+# which write the event Google returned straight through).
+
+
+def _event_row(user_id, calendar_id, event):
+    """calendar_events row for a Google event resource"""
+    start = event.get('start') or {}
+    end = event.get('end') or {}
+    return (
+        user_id,
+        calendar_id,
+        event['id'],
+        event.get('summary'),
+        start.get('dateTime') or start.get('date'),
+        end.get('dateTime') or end.get('date'),
+        'date' in start and 'dateTime' not in start,
+        Json(event),
+    )
+
+
+def _upsert_events(cur, user_id, calendar_id, events):
+    rows = [_event_row(user_id, calendar_id, event) for event in events]
+    if not rows:
+        return
+    execute_values(
+        cur,
+        """
+        INSERT INTO calendar_events (user_id, calendar_id, event_id, summary, start_at, end_at, all_day, payload)
+        VALUES %s
+        ON CONFLICT (user_id, calendar_id, event_id)
+        DO UPDATE SET
+        summary = EXCLUDED.summary,
+        start_at = EXCLUDED.start_at,
+        end_at = EXCLUDED.end_at,
+        all_day = EXCLUDED.all_day,
+        payload = EXCLUDED.payload,
+        updated_at = CURRENT_TIMESTAMP;
+        """,
+        rows,
+        template="(%s, %s, %s, %s, %s::timestamptz, %s::timestamptz, %s, %s)"
+    )
+
+
+def get_sync_state(user_id, calendar_id):
+    """
+    Returns {"sync_token", "synced_at", "age_seconds"} for a calendar,
+    or None if it was never synced.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                SELECT sync_token, synced_at, EXTRACT(EPOCH FROM (LOCALTIMESTAMP - synced_at))
+                FROM calendar_sync_state
+                WHERE user_id = %s AND calendar_id = %s;
+                """,
+                (user_id, calendar_id)
+            )
+            row = cur.fetchone()
+            conn.commit()
+            if row is None:
+                return None
+            return {
+                "sync_token": row[0],
+                "synced_at": row[1],
+                "age_seconds": float(row[2]) if row[2] is not None else None,
+            }
+        except Exception as e:
+            conn.rollback()
+            print(f"Error reading sync state: {e}")
+            return None
+        finally:
+            cur.close()
+
+
+def apply_sync(user_id, calendar_id, events, sync_token, full=False):
+    """
+    Writes one sync run in a single transaction: cancelled events are deleted,
+    the rest upserted, and the new sync token saved. A full sync replaces
+    everything stored for the calendar.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            if full:
+                cur.execute(
+                    "DELETE FROM calendar_events WHERE user_id = %s AND calendar_id = %s;",
+                    (user_id, calendar_id)
+                )
+            cancelled = [event['id'] for event in events if event.get('status') == 'cancelled']
+            if cancelled and not full:
+                cur.execute(
+                    "DELETE FROM calendar_events WHERE user_id = %s AND calendar_id = %s AND event_id = ANY(%s);",
+                    (user_id, calendar_id, cancelled)
+                )
+            _upsert_events(cur, user_id, calendar_id, [event for event in events if event.get('status') != 'cancelled'])
+            cur.execute(
+                """
+                INSERT INTO calendar_sync_state (user_id, calendar_id, sync_token, synced_at)
+                VALUES (%s, %s, %s, LOCALTIMESTAMP)
+                ON CONFLICT (user_id, calendar_id)
+                DO UPDATE SET
+                sync_token = EXCLUDED.sync_token,
+                synced_at = EXCLUDED.synced_at;
+                """,
+                (user_id, calendar_id, sync_token)
+            )
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"Error applying calendar sync: {e}")
+            return False
+        finally:
+            cur.close()
+
+
+def save_local_events(user_id, calendar_id, events):
+    """Write-through for events we just created in Google"""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            _upsert_events(cur, user_id, calendar_id, events)
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"Error saving local events: {e}")
+            return False
+        finally:
+            cur.close()
+
+
+LOCAL_EVENTS_SQL = """
+    SELECT payload
+    FROM calendar_events
+    WHERE user_id = %s AND calendar_id = %s
+      AND (%s::timestamptz IS NULL OR end_at > %s::timestamptz)
+      AND (%s::timestamptz IS NULL OR start_at < %s::timestamptz)
+    ORDER BY start_at, event_id
+    LIMIT %s;
+"""
+
+
+def get_local_events(user_id, calendar_id, limit=20, time_min=None, time_max=None):
+    """
+    Stored events of one calendar (Google event resources), ordered by start.
+    time_min / time_max (aware datetimes, optional) keep only events overlapping the window.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(LOCAL_EVENTS_SQL, (user_id, calendar_id, time_min, time_min, time_max, time_max, limit))
+            rows = cur.fetchall()
+            conn.commit()
+            return [row[0] for row in rows]
+        except Exception as e:
+            conn.rollback()
+            print(f"Error fetching local events: {e}")
+            return []
+        finally:
+            cur.close()
+
+
+def forget_calendar(user_id, calendar_id):
+    """Drops a calendar's stored events and sync token (next read does a full sync)"""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM calendar_events WHERE user_id = %s AND calendar_id = %s;", (user_id, calendar_id))
+            cur.execute("DELETE FROM calendar_sync_state WHERE user_id = %s AND calendar_id = %s;", (user_id, calendar_id))
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            print(f"Error forgetting calendar: {e}")
+            return False
+        finally:
+            cur.close()
+
+
+def get_busy_intervals(user_id, range_start, range_end, calendar_ids=None):
+    """
+    (start_at, end_at, summary) of the stored events overlapping
+    [range_start, range_end). Transparent ("free") events don't count.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                SELECT start_at, end_at, summary
+                FROM calendar_events
+                WHERE user_id = %s
+                  AND (%s::text[] IS NULL OR calendar_id = ANY(%s::text[]))
+                  AND start_at < %s AND end_at > %s
+                  AND COALESCE(payload->>'transparency', 'opaque') <> 'transparent';
+                """,
+                (user_id, calendar_ids, calendar_ids, range_end, range_start)
+            )
+            rows = cur.fetchall()
+            conn.commit()
+            return rows
+        except Exception as e:
+            conn.rollback()
+            print(f"Error fetching busy intervals: {e}")
+            return []
+        finally:
+            cur.close()
@@ -1,8 +1,12 @@
 import os
+import threading
+import time
+from contextlib import contextmanager
 from typing import Optional
 from datetime import datetime
 from dotenv import load_dotenv
 import psycopg2
+from psycopg2 import extensions
 
 load_dotenv() # Make sure to load your .env file
 
@@ -12,12 +16,266 @@ DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_PORT = os.getenv('DB_PORT')
 
-def get_connection():
-    """Helper function to create database connection"""
+# Pool sizing (see get_pool_stats() to tune these)
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+DB_POOL_IDLE_TIMEOUT = float(os.getenv('DB_POOL_IDLE_TIMEOUT', '300'))
+# Connections idle for longer than this get a "SELECT 1" before being handed out
+DB_POOL_HEALTH_CHECK_AFTER = float(os.getenv('DB_POOL_HEALTH_CHECK_AFTER', '30'))
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection became free within the checkout timeout."""
+
+
+class PoolClosedError(Exception):
+    """Raised when checking a connection out of a pool that was closed."""
+
+
+def _open_connection():
+    """Opens a brand new psycopg2 connection"""
     return psycopg2.connect(
         host=DB_HOST,
         dbname=DB_NAME,
         user=DB_USER,
         password=DB_PASSWORD,
         port=DB_PORT
-    )
\ No newline at end of file
+    )
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+    - keeps between min_size and max_size connections open
+    - health checks connections that sat idle for a while before handing them out
+    - closes connections idle for longer than idle_timeout (down to min_size)
+    - tracks wait time and utilisation so the pool can be sized
+    """
+
+    def __init__(self, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE, timeout=DB_POOL_TIMEOUT,
+                 idle_timeout=DB_POOL_IDLE_TIMEOUT, health_check_after=DB_POOL_HEALTH_CHECK_AFTER,
+                 connect=_open_connection):
+        if max_size < 1 or min_size > max_size:
+            raise ValueError("Pool needs 0 <= min_size <= max_size and max_size >= 1")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self._connect = connect
+
+        self._cond = threading.Condition()
+        self._idle = []  # list of (conn, returned_at), most recently used last
+        self._size = 0   # open connections (idle + in use)
+        self._in_use = 0
+        self._closed = False
+
+        # stats
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._created = 0
+        self._discarded = 0
+        self._peak_in_use = 0
+
+    def _discard(self, conn):
+        """Closes a connection we no longer want. Caller holds the lock."""
+        self._size -= 1
+        self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self, now):
+        """Drops connections idle for too long, keeping at least min_size. Caller holds the lock."""
+        while self._idle and self._size > self.min_size:
+            conn, returned_at = self._idle[0]
+            if now - returned_at < self.idle_timeout:
+                break
+            self._idle.pop(0)
+            self._discard(conn)
+
+    def _is_healthy(self, conn, returned_at, now):
+        if conn.closed:
+            return False
+        if now - returned_at < self.health_check_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """Checks a connection out of the pool, waiting up to `timeout` seconds."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosedError("Connection pool is closed")
+                now = time.monotonic()
+                self._evict_idle(now)
+
+                if self._idle:
+                    # health check outside the lock: a slow or hung connection
+                    # must not hold up every other checkout and return
+                    conn, returned_at = self._idle.pop()
+                    self._cond.release()
+                    try:
+                        healthy = self._is_healthy(conn, returned_at, now)
+                    finally:
+                        self._cond.acquire()
+                    if not healthy or self._closed:
+                        self._discard(conn)
+                        self._cond.notify()
+                        continue
+                    break
+
+                if self._size < self.max_size:
+                    # reserve the slot, connect outside the lock
+                    self._size += 1
+                    self._cond.release()
+                    try:
+                        conn = self._connect()
+                    except Exception:
+                        self._cond.acquire()
+                        self._size -= 1
+                        self._cond.notify()
+                        raise
+                    self._cond.acquire()
+                    self._created += 1
+                    break
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"No database connection free after {self.timeout}s (max_size={self.max_size})"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+
+            wait = time.monotonic() - started
+            self._checkouts += 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+            if waited:
+                self._waits += 1
+            return conn
+
+    def putconn(self, conn):
+        """Returns a connection to the pool, rolling back anything left uncommitted."""
+        broken = conn.closed
+        if not broken:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                broken = True
+
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager: `with pool.connection() as conn:`"""
+        conn = self.getconn()
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            self.putconn(conn)
+
+    def close(self):
+        """Closes all idle connections; in-use ones are closed when returned."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "peak_in_use": self._peak_in_use,
+                "utilisation": self._in_use / self.max_size,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": (self._total_wait / self._checkouts * 1000) if self._checkouts else 0.0,
+                "max_wait_ms": self._max_wait * 1000,
+                "connections_created": self._created,
+                "connections_discarded": self._discarded,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the process wide pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+@contextmanager
+def get_connection():
+    """
+    Helper to borrow a pooled database connection:
+
+        with get_connection() as conn:
+            cur = conn.cursor()
+            ...
+
+    The connection goes back to the pool (not closed) when the block ends.
+    """
+    with get_pool().connection() as conn:
+        yield conn
+
+
+def get_pool_stats():
+    """Wait time / utilisation numbers for sizing the pool"""
+    if _pool is None:
+        return {}
+    return _pool.stats()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
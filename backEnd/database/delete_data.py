@@ -0,0 +1,43 @@
+from .connection import get_connection
+from .id_cache import invalidate_user, invalidate_chat
+
+
+def delete_app_user(user_id):
+    """
+    Deletes a user. chat_sessions, messages and user_credentials rows
+    go with it through the ON DELETE CASCADE foreign keys.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM app_users WHERE id = %s;", (user_id,))
+            deleted = cur.rowcount > 0
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Error deleting user: {e}")
+            return False
+        finally:
+            cur.close()
+
+    invalidate_user(user_id)
+    return deleted
+
+
+def delete_chat(chat_id):
+    """Deletes a chat session and (by cascade) its messages."""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("DELETE FROM chat_sessions WHERE id = %s;", (chat_id,))
+            deleted = cur.rowcount > 0
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Error deleting chat: {e}")
+            return False
+        finally:
+            cur.close()
+
+    invalidate_chat(chat_id)
+    return deleted
@@ -1,4 +1,6 @@
 from .connection import get_connection
+from .id_cache import user_id_cache, chat_id_cache, remember_turn_ids
+from .partitions import HISTORY_WINDOW_DAYS
 from sqlmodel import Field, Relationship, SQLModel, create_engine, Session
 
 def get_or_create_app_user(user_identifier):
@@ -6,159 +8,395 @@ def get_or_create_app_user(user_identifier):
     Input: user_identifier (str) -> e.g., "+97250..."
     Output: internal_user_id (int) -> e.g., 5
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT id FROM app_users WHERE user_identifier = %s;", (user_identifier,))
-        result = cur.fetchone()
-        if result:
-            return result[0] 
-        else:
-            cur.execute(
-                "INSERT INTO app_users (user_identifier) VALUES (%s) RETURNING id;",
-                (user_identifier,)
-            )
-            new_id = cur.fetchone()[0]
-            conn.commit()
-            return new_id
-    except Exception as e:
-        conn.rollback()
-        print(f"Error in get_or_create_app_user: {e}")
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+    cached_id = user_id_cache.get(user_identifier)
+    if cached_id is not None:
+        return cached_id
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT id FROM app_users WHERE user_identifier = %s;", (user_identifier,))
+            result = cur.fetchone()
+            if result:
+                user_id_cache.set(user_identifier, result[0])
+                return result[0] 
+            else:
+                cur.execute(
+                    "INSERT INTO app_users (user_identifier) VALUES (%s) RETURNING id;",
+                    (user_identifier,)
+                )
+                new_id = cur.fetchone()[0]
+                conn.commit()
+                user_id_cache.set(user_identifier, new_id)
+                return new_id
+        except Exception as e:
+            conn.rollback()
+            print(f"Error in get_or_create_app_user: {e}")
+            raise e
+        finally:
+            cur.close()
 
 def get_user_google_creds(user_id,service_name='google_calendar'):
     """
     Check if we have tokens for this internal user ID
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            """
-            SELECT access_token, refresh_token, scopes 
-            FROM user_credentials 
-            WHERE user_id = %s AND service_name = %s;
-            """, (user_id,service_name)
-        )
-        result = cur.fetchone()
-        if result:
-             return {
-                'access_token': result[0],
-                'refresh_token': result[1],
-                'scopes': result[2]
-            }
-        return None
-    except Exception as e:
-        print(f"Error fetching creds: {e}")
-        return None
-    finally:
-        cur.close()
-        conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                SELECT access_token, refresh_token, scopes, token_expiry 
+                FROM user_credentials 
+                WHERE user_id = %s AND service_name = %s;
+                """, (user_id,service_name)
+            )
+            result = cur.fetchone()
+            if result:
+                 return {
+                    'access_token': result[0],
+                    'refresh_token': result[1],
+                    'scopes': result[2],
+                    'token_expiry': result[3]
+                }
+            return None
+        except Exception as e:
+            print(f"Error fetching creds: {e}")
+            return None
+        finally:
+            cur.close()
+
+def get_expiring_credentials(within_seconds, service_name='google_calendar', user_ids=None):
+    """
+    (user_id, access_token, refresh_token, scopes, token_expiry) rows whose token
+    expires within the next `within_seconds`, optionally only for user_ids.
+    token_expiry is stored in UTC.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(
+                """
+                SELECT user_id, access_token, refresh_token, scopes, token_expiry
+                FROM user_credentials
+                WHERE service_name = %s
+                  AND refresh_token IS NOT NULL
+                  AND (%s::int[] IS NULL OR user_id = ANY(%s::int[]))
+                  AND (token_expiry IS NULL
+                       OR token_expiry < (NOW() AT TIME ZONE 'UTC') + make_interval(secs => %s))
+                ORDER BY token_expiry NULLS FIRST;
+                """, (service_name, user_ids, user_ids, within_seconds)
+            )
+            return cur.fetchall()
+        except Exception as e:
+            print(f"Error fetching expiring creds: {e}")
+            return []
+        finally:
+            cur.close()
+
+CHAT_ID_SQL = "SELECT id FROM chat_sessions WHERE user_id = %s AND session_name = %s;"
 
 def get_or_create_chat(user_id, chat_name="New Chat"):
-    conn = get_connection()
-    cur = conn.cursor()
+    cached_id = chat_id_cache.get((user_id, chat_name))
+    if cached_id is not None:
+        return cached_id
+
+    with get_connection() as conn:
+        cur = conn.cursor()
     
-    try:
+        try:
         
-        cur.execute(
-            "SELECT id FROM chat_sessions WHERE user_id = %s AND session_name = %s;", 
-            (user_id, chat_name)
-        )
-        result = cur.fetchone()
+            cur.execute(CHAT_ID_SQL, (user_id, chat_name))
+            result = cur.fetchone()
         
-        if result:
-            return result[0]  
-        else:
-            cur.execute(
-                "INSERT INTO chat_sessions (user_id, session_name) VALUES (%s, %s) RETURNING id;",
-                (user_id, chat_name)
-            )
-            chat_id = cur.fetchone()[0]
-            conn.commit()
-            return chat_id
-    except Exception as e:
-        conn.rollback()
-        print(f"Error getting/creating chat: {e}")
-        return None
-    finally:
-        cur.close()
-        conn.close()
+            if result:
+                chat_id_cache.set((user_id, chat_name), result[0])
+                return result[0]  
+            else:
+                # the unique (user_id, session_name) constraint makes a concurrent create a no-op
+                cur.execute(
+                    """
+                    INSERT INTO chat_sessions (user_id, session_name) VALUES (%s, %s)
+                    ON CONFLICT (user_id, session_name) DO NOTHING
+                    RETURNING id;
+                    """,
+                    (user_id, chat_name)
+                )
+                result = cur.fetchone()
+                conn.commit()
+                if not result:
+                    cur.execute(CHAT_ID_SQL, (user_id, chat_name))
+                    result = cur.fetchone()
+                chat_id = result[0]
+                chat_id_cache.set((user_id, chat_name), chat_id)
+                return chat_id
+        except Exception as e:
+            conn.rollback()
+            print(f"Error getting/creating chat: {e}")
+            return None
+        finally:
+            cur.close()
 def get_user_chats(user_id):
     """Gets all chat sessions for a specific user."""
-    conn = get_connection()
-    cur = conn.cursor()
+    with get_connection() as conn:
+        cur = conn.cursor()
     
-    try:
-        cur.execute(
-            "SELECT id, session_name FROM chat_sessions WHERE user_id = %s ORDER BY id DESC;",
-            (user_id,)
+        try:
+            cur.execute(
+                "SELECT id, session_name FROM chat_sessions WHERE user_id = %s ORDER BY id DESC;",
+                (user_id,)
+            )
+            chats = cur.fetchall()
+            return chats 
+        except Exception as e:
+            print(f"Error retrieving chats: {e}")
+            return []
+        finally:
+            cur.close()
+
+def format_history(rows):
+    """(is_from_bot, text) rows, oldest first -> Gemini history"""
+    history = []
+    for is_bot, text in rows:
+        role = "model" if is_bot else "user"
+        history.append({
+            "role": role, 
+            "parts": [{"text": text}] 
+        })
+    return history
+
+# Newest messages of a chat inside the history window, or - when the window
+# is empty because the user was away - the newest messages of any age.
+HISTORY_SQL = """
+    WITH recent AS (
+        SELECT is_from_bot, text, created_at, id
+        FROM messages
+        WHERE chat_id = %(chat_id)s
+          AND created_at >= LOCALTIMESTAMP - make_interval(days => %(history_days)s::int)
+          AND id IS DISTINCT FROM %(exclude_message_id)s::int
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s
+    )
+    SELECT * FROM (
+        SELECT * FROM recent
+        UNION ALL
+        (
+            SELECT is_from_bot, text, created_at, id
+            FROM messages
+            WHERE chat_id = %(chat_id)s
+              AND id IS DISTINCT FROM %(exclude_message_id)s::int
+              AND NOT EXISTS (SELECT 1 FROM recent)
+            ORDER BY created_at DESC, id DESC
+            LIMIT %(limit)s
         )
-        chats = cur.fetchall()
-        return chats 
-    except Exception as e:
-        print(f"Error retrieving chats: {e}")
-        return []
-    finally:
-        cur.close()
-        conn.close()
-
-def get_chat_history_as_text(chat_id, limit=10):
+    ) history
+    ORDER BY created_at DESC, id DESC;
+"""
+
+def get_chat_history_as_text(chat_id, limit=10, exclude_message_id=None):
     """
     Fetches DB messages and formats them for Gemini context
     Fixed to return [{"text": "message"}] instead of ["message"]
+    exclude_message_id: skip this message (e.g. the one we are about to send)
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT is_from_bot, text 
-            FROM messages 
-            WHERE chat_id = %s 
-            ORDER BY created_at DESC 
-            LIMIT %s;
-        """, (chat_id, limit))
-        
-        rows = cur.fetchall()
-        rows.reverse() 
-        
-        history = []
-        for is_bot, text in rows:
-            role = "model" if is_bot else "user"
-            history.append({
-                "role": role, 
-                "parts": [{"text": text}] 
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            # the created_at window lets Postgres skip old monthly partitions;
+            # the second branch only runs when the window has nothing
+            cur.execute(HISTORY_SQL, {
+                'chat_id': chat_id,
+                'history_days': HISTORY_WINDOW_DAYS,
+                'exclude_message_id': exclude_message_id,
+                'limit': limit,
             })
-            
-        return history
-    finally:
-        cur.close()
-        conn.close()
+        
+            rows = [(is_from_bot, text) for is_from_bot, text, _, _ in cur.fetchall()]
+            rows.reverse() 
+            return format_history(rows)
+        finally:
+            cur.close()
+
+# Messages of a chat for get_user_messages, with the same empty-window fallback as HISTORY_SQL
+USER_MESSAGES_SQL = """
+    WITH recent AS (
+        SELECT id, text, is_from_bot, created_at
+        FROM messages
+        WHERE user_id = %(user_id)s AND chat_id = %(chat_id)s
+          AND created_at >= LOCALTIMESTAMP - make_interval(days => %(history_days)s::int)
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s
+    )
+    SELECT * FROM (
+        SELECT * FROM recent
+        UNION ALL
+        (
+            SELECT id, text, is_from_bot, created_at
+            FROM messages
+            WHERE user_id = %(user_id)s AND chat_id = %(chat_id)s
+              AND NOT EXISTS (SELECT 1 FROM recent)
+            ORDER BY created_at DESC, id DESC
+            LIMIT %(limit)s
+        )
+    ) history
+    ORDER BY created_at DESC, id DESC;
+"""
 
 def get_user_messages(user_id,chat_id, limit=50):
-    conn = get_connection()
-    cur = conn.cursor()
+    with get_connection() as conn:
+        cur = conn.cursor()
     
-    try:
-        cur.execute(
-            
-            """
-            SELECT id, text, is_from_bot, created_at 
-            FROM messages 
-            WHERE user_id = %s AND chat_id = %s
-            ORDER BY created_at DESC 
-            LIMIT %s;
-            """,
-            (user_id, chat_id, limit)
+        try:
+            cur.execute(
+                USER_MESSAGES_SQL,
+                {'user_id': user_id, 'chat_id': chat_id, 'history_days': HISTORY_WINDOW_DAYS, 'limit': limit}
+            )
+            messages = cur.fetchall()
+            return messages
+        except Exception as e:
+            print(f"Error retrieving messages: {e}")
+            return []
+        finally:
+            cur.close()
+
+
+class TurnNotStartedError(Exception):
+    """BEGIN_TURN_SQL returned no row, even after the retry."""
+
+
+BEGIN_TURN_SQL = """
+    WITH new_user AS (
+        INSERT INTO app_users (user_identifier)
+        SELECT %(user_identifier)s::varchar
+        WHERE NOT EXISTS (SELECT 1 FROM app_users WHERE user_identifier = %(user_identifier)s::varchar)
+        ON CONFLICT (user_identifier) DO NOTHING
+        RETURNING id
+    ),
+    app_user AS (
+        SELECT id FROM new_user
+        UNION ALL
+        SELECT id FROM app_users WHERE user_identifier = %(user_identifier)s::varchar
+    ),
+    existing_chat AS (
+        SELECT c.id FROM chat_sessions c JOIN app_user u ON c.user_id = u.id
+        WHERE c.session_name = %(chat_name)s::text
+    ),
+    new_chat AS (
+        INSERT INTO chat_sessions (user_id, session_name)
+        SELECT id, %(chat_name)s::text FROM app_user
+        WHERE NOT EXISTS (SELECT 1 FROM existing_chat)
+        ON CONFLICT (user_id, session_name) DO NOTHING
+        RETURNING id
+    ),
+    chat AS (
+        SELECT id FROM existing_chat
+        UNION ALL
+        SELECT id FROM new_chat
+    ),
+    recent_history AS (
+        SELECT m.id, m.is_from_bot, m.text, m.created_at
+        FROM messages m JOIN chat ON m.chat_id = chat.id
+        WHERE m.created_at >= LOCALTIMESTAMP - make_interval(days => %(history_days)s::int)
+        ORDER BY m.created_at DESC, m.id DESC
+        LIMIT %(history_limit)s
+    ),
+    history AS (
+        SELECT * FROM recent_history
+        UNION ALL
+        -- nothing inside the window (user back after a long break): newest rows of any age
+        (
+            SELECT m.id, m.is_from_bot, m.text, m.created_at
+            FROM messages m JOIN chat ON m.chat_id = chat.id
+            WHERE NOT EXISTS (SELECT 1 FROM recent_history)
+            ORDER BY m.created_at DESC, m.id DESC
+            LIMIT %(history_limit)s
         )
-        messages = cur.fetchall()
-        return messages
-    except Exception as e:
-        print(f"Error retrieving messages: {e}")
-        return []
-    finally:
-        cur.close()
-        conn.close()
+    ),
+    new_message AS (
+        INSERT INTO messages (text, is_from_bot, user_id, chat_id, created_at)
+        SELECT %(text)s::text, FALSE, app_user.id, chat.id, CURRENT_TIMESTAMP FROM app_user, chat
+        RETURNING id
+    )
+    SELECT
+        app_user.id,
+        chat.id,
+        new_message.id,
+        cred.access_token,
+        cred.refresh_token,
+        cred.scopes,
+        cred.token_expiry,
+        (
+            SELECT COALESCE(json_agg(json_build_array(h.is_from_bot, h.text) ORDER BY h.created_at, h.id), '[]'::json)
+            FROM history h
+        ) AS history
+    FROM app_user
+    CROSS JOIN chat
+    CROSS JOIN new_message
+    LEFT JOIN user_credentials cred
+        ON cred.user_id = app_user.id AND cred.service_name = %(service_name)s::varchar;
+"""
+
+
+def begin_turn(user_identifier, text, chat_name="WhatsApp_General", history_limit=10, service_name='google_calendar'):
+    """
+    Everything a turn needs before calling Gemini, in one transaction and one round trip:
+    upserts the user and chat, stores the inbound message and returns
+    {
+        "user_id": 5, "chat_id": 7, "message_id": 120,
+        "creds": {...} or None,     # same shape as get_user_google_creds
+        "history": [...]            # same shape as get_chat_history_as_text
+    }
+    The history is the last `history_limit` messages *before* the inbound one,
+    since send_message sends the inbound text to Gemini itself.
+    """
+    params = {
+        'user_identifier': user_identifier,
+        'chat_name': chat_name,
+        'text': text,
+        'history_limit': history_limit,
+        'service_name': service_name,
+        'history_days': HISTORY_WINDOW_DAYS,
+    }
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(BEGIN_TURN_SQL, params)
+            row = cur.fetchone()
+            if row is None:
+                # A concurrent first message created the user/chat after our snapshot
+                # was taken; a fresh statement sees it.
+                cur.execute(BEGIN_TURN_SQL, params)
+                row = cur.fetchone()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Error in begin_turn: {e}")
+            raise e
+        finally:
+            cur.close()
+
+    if row is None:
+        raise TurnNotStartedError(f"Could not start a turn for {user_identifier!r} in {chat_name!r}")
+    turn = _turn_from_row(row)
+    remember_turn_ids(user_identifier, chat_name, turn['user_id'], turn['chat_id'])
+    return turn
+
+
+def _turn_from_row(row):
+    """Shapes a BEGIN_TURN_SQL row like the individual getters would"""
+    user_id, chat_id, message_id, access_token, refresh_token, scopes, token_expiry, history_rows = row
+    creds = None
+    if access_token is not None or refresh_token is not None:
+        creds = {
+            'access_token': access_token,
+            'refresh_token': refresh_token,
+            'scopes': scopes,
+            'token_expiry': token_expiry,
+        }
+
+    return {
+        'user_id': user_id,
+        'chat_id': chat_id,
+        'message_id': message_id,
+        'creds': creds,
+        'history': format_history(history_rows),
+    }
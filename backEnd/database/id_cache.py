@@ -0,0 +1,45 @@
+import os
+from utils.ttl_cache import TTLCache
+
+# user_identifier -> app_users.id and (user_id, session_name) -> chat_sessions.id
+# never change while the rows exist, so we keep them in memory.
+# The TTL bounds how long a row deleted by another process can be served.
+ID_CACHE_SIZE = int(os.getenv('ID_CACHE_SIZE', '10000'))
+ID_CACHE_TTL = float(os.getenv('ID_CACHE_TTL', '3600'))
+
+user_id_cache = TTLCache(maxsize=ID_CACHE_SIZE, ttl=ID_CACHE_TTL)
+chat_id_cache = TTLCache(maxsize=ID_CACHE_SIZE, ttl=ID_CACHE_TTL)
+
+
+def remember_turn_ids(user_identifier, chat_name, user_id, chat_id):
+    user_id_cache.set(user_identifier, user_id)
+    chat_id_cache.set((user_id, chat_name), chat_id)
+
+
+def peek_chat_id(user_identifier, chat_name):
+    """Cached chat id for a user identifier, or None. Doesn't touch the counters."""
+    user_id = user_id_cache.peek(user_identifier)
+    if user_id is None:
+        return None
+    return chat_id_cache.peek((user_id, chat_name))
+
+
+def invalidate_user(user_id):
+    """
+    Call after deleting an app_users row. The FKs cascade to chat_sessions,
+    messages and user_credentials, so the user's chats go too.
+    """
+    user_id_cache.invalidate_where(lambda identifier, cached_id: cached_id == user_id)
+    chat_id_cache.invalidate_where(lambda key, cached_id: key[0] == user_id)
+
+
+def invalidate_chat(chat_id):
+    """Call after deleting a chat_sessions row."""
+    chat_id_cache.invalidate_where(lambda key, cached_id: cached_id == chat_id)
+
+
+def get_id_cache_stats():
+    return {
+        "users": user_id_cache.stats(),
+        "chats": chat_id_cache.stats(),
+    }
@@ -0,0 +1,107 @@
+from .async_connection import get_async_connection
+
+# inbound_messages: what /webhook accepted and where each message is in the
+# pipeline (pending -> processing -> done | failed).
+
+
+async def insert_inbound_async(user_identifier, text, idempotency_key=None, channel='webhook', status='pending',
+                               claimed_by=None, lease_seconds=0):
+    """
+    Persists an accepted message and returns its id.
+    Returns None if a message with the same (user_identifier, idempotency_key)
+    was already accepted, unless that one failed - then it is claimed again.
+    claimed_by (a worker pool's owner id) keeps other processes from
+    recovering the message for lease_seconds.
+    """
+    async with get_async_connection() as conn:
+        return await conn.fetchval(
+            """
+            INSERT INTO inbound_messages (user_identifier, text, idempotency_key, channel, status, claimed_by, lease_until)
+            VALUES ($1, $2, $3, $4, $5, $6::varchar,
+                    CASE WHEN $6::varchar IS NULL THEN NULL
+                         ELSE LOCALTIMESTAMP + make_interval(secs => $7::float8) END)
+            ON CONFLICT (user_identifier, idempotency_key)
+            DO UPDATE SET status = EXCLUDED.status, last_error = NULL,
+                          claimed_by = EXCLUDED.claimed_by, lease_until = EXCLUDED.lease_until
+            WHERE inbound_messages.status = 'failed'
+            RETURNING id;
+            """,
+            user_identifier, text, idempotency_key, channel, status, claimed_by, lease_seconds
+        )
+
+
+async def get_inbound_response_async(user_identifier, idempotency_key):
+    """(status, response) of an earlier delivery of the same message, or None"""
+    async with get_async_connection() as conn:
+        row = await conn.fetchrow(
+            """
+            SELECT status, response
+            FROM inbound_messages
+            WHERE user_identifier = $1 AND idempotency_key = $2;
+            """,
+            user_identifier, idempotency_key
+        )
+    return tuple(row) if row else None
+
+
+async def mark_inbound_processing_async(inbound_id, lease_seconds=0):
+    """Returns the attempt number this run is; renews the owner's lease"""
+    async with get_async_connection() as conn:
+        return await conn.fetchval(
+            """
+            UPDATE inbound_messages
+            SET status = 'processing', attempts = attempts + 1,
+                lease_until = LOCALTIMESTAMP + make_interval(secs => $2::float8)
+            WHERE id = $1
+            RETURNING attempts;
+            """,
+            inbound_id, lease_seconds
+        )
+
+
+async def finish_inbound_async(inbound_id, status, response=None, last_error=None):
+    """status: 'done', 'failed', or 'pending' (will be retried)"""
+    async with get_async_connection() as conn:
+        try:
+            await conn.execute(
+                """
+                UPDATE inbound_messages
+                SET status = $2::varchar,
+                    response = COALESCE($3::text, response),
+                    last_error = $4::text,
+                    processed_at = CASE WHEN $2::varchar = 'pending' THEN NULL ELSE LOCALTIMESTAMP END
+                WHERE id = $1;
+                """,
+                inbound_id, status, response, last_error
+            )
+        except Exception as e:
+            print(f"Error updating inbound message {inbound_id}: {e}")
+
+
+async def recover_inbound_async(claimed_by, lease_seconds):
+    """
+    Claims messages accepted but not finished by a process that is gone (its
+    lease ran out, e.g. the server restarted mid-turn) for claimed_by.
+    Each row is claimed by one caller only, even with several processes
+    recovering at once. Oldest first: [(id, user_identifier, text, received_at)]
+    """
+    async with get_async_connection() as conn:
+        rows = await conn.fetch(
+            """
+            UPDATE inbound_messages
+            SET claimed_by = $1::varchar,
+                lease_until = LOCALTIMESTAMP + make_interval(secs => $2::float8)
+            WHERE id IN (
+                SELECT id
+                FROM inbound_messages
+                WHERE status IN ('pending', 'processing') AND channel = 'webhook'
+                  AND claimed_by IS DISTINCT FROM $1::varchar
+                  AND (lease_until IS NULL OR lease_until < LOCALTIMESTAMP)
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, user_identifier, text, received_at;
+            """,
+            claimed_by, lease_seconds
+        )
+    return sorted(tuple(row) for row in rows)
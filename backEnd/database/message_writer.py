@@ -0,0 +1,215 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+import psycopg2
+from psycopg2.extras import execute_values
+from .connection import get_connection
+from .save_new_data import insert_message
+from .async_data import insert_message_async
+
+# Optional write-behind mode for messages: instead of one INSERT + COMMIT per
+# message, messages are queued and a background thread writes them in batches
+# (one multi-row INSERT and one commit per batch).
+MESSAGE_WRITE_BEHIND = os.getenv('MESSAGE_WRITE_BEHIND', '0') == '1'
+# wait for the batch holding the bot reply to commit before answering
+MESSAGE_WRITE_BEHIND_FENCE = os.getenv('MESSAGE_WRITE_BEHIND_FENCE', '0') == '1'
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('MESSAGE_WRITE_BEHIND_BATCH_SIZE', '200'))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('MESSAGE_WRITE_BEHIND_FLUSH_INTERVAL', '0.05'))
+WRITE_BEHIND_MAX_RETRIES = 3
+
+_INSERT_BATCH_SQL = "INSERT INTO messages (text, is_from_bot, user_id, chat_id, created_at) VALUES %s;"
+# created_at is taken at submit(), not at flush, so a queued reply can't sort
+# after a message that was inserted directly while it sat in the queue
+_ROW_TEMPLATE = "(%s, %s, %s, %s, %s)"
+
+
+class MessageWriter:
+    """
+    Background batch writer for the messages table.
+    submit() returns a sequence number; fence(seq) blocks until that message
+    is committed (or its batch gave up) and says which one happened.
+    """
+
+    def __init__(self, batch_size=WRITE_BEHIND_BATCH_SIZE, flush_interval=WRITE_BEHIND_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._submitted = 0   # last sequence number handed out
+        self._done = 0        # every seq <= this is committed or failed
+        self._failed = []     # (first_seq, last_seq) of batches that were dropped
+        self._closing = False
+        self.batches = 0
+        self.rows = 0
+        self.failed_rows = 0
+        self.flush_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, text, is_from_bot, user_id, chat_id):
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("MessageWriter is closed")
+            self._submitted += 1
+            seq = self._submitted
+            # enqueue under the lock so queue order == sequence order
+            self._queue.put((seq, (text, is_from_bot, user_id, chat_id, datetime.now(timezone.utc))))
+        return seq
+
+    def fence(self, seq=None, timeout=None):
+        """
+        Waits until message `seq` (default: everything submitted so far) is written.
+        Returns True if it was committed, False if its batch failed or we timed out.
+        """
+        with self._cond:
+            if seq is None:
+                seq = self._submitted
+            if not self._cond.wait_for(lambda: self._done >= seq, timeout):
+                return False
+            return not any(first <= seq <= last for first, last in self._failed)
+
+    async def fence_async(self, seq=None, timeout=None):
+        return await asyncio.to_thread(self.fence, seq, timeout)
+
+    def _next_batch(self):
+        """Blocks for the first message, then collects until batch_size or flush_interval."""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, rows):
+        with get_connection() as conn:
+            cur = conn.cursor()
+            try:
+                execute_values(cur, _INSERT_BATCH_SQL, rows, template=_ROW_TEMPLATE, page_size=len(rows))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def _flush(self, batch):
+        rows = [row for _, row in batch]
+        started = time.monotonic()
+        failed = []
+        written = False
+        for attempt in range(WRITE_BEHIND_MAX_RETRIES):
+            try:
+                self._write(rows)
+                written = True
+                break
+            except psycopg2.OperationalError as e:
+                # connection trouble, worth retrying
+                print(f"Error writing message batch (attempt {attempt + 1}): {e}")
+                time.sleep(0.1 * (2 ** attempt))
+            except Exception as e:
+                print(f"Error writing message batch: {e}")
+                break
+        if not written:
+            # one bad row (e.g. a deleted chat) shouldn't sink the rest of the batch
+            for seq, row in batch:
+                try:
+                    self._write([row])
+                except Exception as e:
+                    print(f"Dropping queued message {seq}: {e}")
+                    failed.append((seq, seq))
+
+        with self._cond:
+            self.flush_seconds += time.monotonic() - started
+            self.batches += 1
+            self.rows += len(rows) - len(failed)
+            self.failed_rows += len(failed)
+            self._failed.extend(failed)
+            del self._failed[:-100]
+            self._done = batch[-1][0]
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                self._flush(batch)
+            elif self._closing and self._queue.empty():
+                return
+
+    def close(self, timeout=10):
+        """Flushes what is queued and stops the writer thread."""
+        with self._cond:
+            self._closing = True
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": self._queue.qsize(),
+                "batches": self.batches,
+                "rows": self.rows,
+                "failed_rows": self.failed_rows,
+                "avg_batch_size": self.rows / self.batches if self.batches else 0.0,
+                "avg_flush_ms": self.flush_seconds / self.batches * 1000 if self.batches else 0.0,
+            }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_message_writer():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = MessageWriter()
+    return _writer
+
+
+def store_message(text, is_from_bot, user_id, chat_id, wait=MESSAGE_WRITE_BEHIND_FENCE):
+    """
+    insert_message, or a queued write when MESSAGE_WRITE_BEHIND is on.
+    With wait=True a queued write only returns once it is committed.
+    Returns True/False for success (the id isn't known until the batch commits).
+    """
+    if not MESSAGE_WRITE_BEHIND:
+        return insert_message(text, is_from_bot, user_id, chat_id) is not None
+    writer = get_message_writer()
+    seq = writer.submit(text, is_from_bot, user_id, chat_id)
+    return writer.fence(seq) if wait else True
+
+
+async def store_message_async(text, is_from_bot, user_id, chat_id, wait=MESSAGE_WRITE_BEHIND_FENCE):
+    """Async store_message; queuing never blocks the event loop."""
+    if not MESSAGE_WRITE_BEHIND:
+        return await insert_message_async(text, is_from_bot, user_id, chat_id) is not None
+    writer = get_message_writer()
+    seq = writer.submit(text, is_from_bot, user_id, chat_id)
+    return await writer.fence_async(seq) if wait else True
+
+
+def get_message_writer_stats():
+    if _writer is None:
+        return {"enabled": MESSAGE_WRITE_BEHIND}
+    return {"enabled": MESSAGE_WRITE_BEHIND, **_writer.stats()}
+
+
+def close_message_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
@@ -0,0 +1,294 @@
+import json
+import sys
+from .connection import get_connection
+from .partitions import partition_messages
+from .get_from_data import BEGIN_TURN_SQL, HISTORY_SQL, USER_MESSAGES_SQL, CHAT_ID_SQL
+from .calendar_store import LOCAL_EVENTS_SQL
+
+# Versioned schema changes. Each entry runs once, in order, inside its own
+# transaction, and is recorded in schema_migrations. Never edit an entry that
+# has shipped - add a new version instead.
+# A step is either an SQL string or a callable taking the cursor.
+MIGRATIONS = [
+    (1, "base schema", [
+        """
+        CREATE TABLE IF NOT EXISTS app_users(
+            id SERIAL PRIMARY KEY,
+            user_identifier VARCHAR(255) UNIQUE NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chat_sessions(
+            id SERIAL PRIMARY KEY,
+            session_name TEXT NOT NULL,
+            user_id INT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            CONSTRAINT fk_user FOREIGN KEY(user_id) REFERENCES app_users(id) ON DELETE CASCADE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS messages(
+            id SERIAL PRIMARY KEY,
+            text TEXT NOT NULL,
+            is_from_bot BOOLEAN NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            user_id INT NOT NULL,  
+            chat_id INT NOT NULL,  
+
+            CONSTRAINT fk_chat FOREIGN KEY(chat_id) REFERENCES chat_sessions(id) ON DELETE CASCADE,
+            CONSTRAINT fk_user FOREIGN KEY(user_id) REFERENCES app_users(id) ON DELETE CASCADE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_credentials(
+            user_id INT NOT NULL,
+            service_name VARCHAR(50) NOT NULL,
+            access_token TEXT,
+            refresh_token TEXT,
+            token_expiry TIMESTAMP,
+            scopes TEXT, 
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, service_name),
+            CONSTRAINT fk_cred_user FOREIGN KEY(user_id) REFERENCES app_users(id) ON DELETE CASCADE
+        );
+        """,
+    ]),
+    (2, "hot path indexes on messages", [
+        # get_chat_history_as_text / begin_turn history
+        "CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages (chat_id, created_at, id);",
+        # get_user_messages
+        "CREATE INDEX IF NOT EXISTS idx_messages_user_chat_created ON messages (user_id, chat_id, created_at);",
+    ]),
+    (3, "one chat session per (user_id, session_name)", [
+        # fold duplicate sessions created by the old select-then-insert race into the oldest one
+        """
+        UPDATE messages m
+        SET chat_id = keep.id
+        FROM chat_sessions dup
+        JOIN (
+            SELECT user_id, session_name, MIN(id) AS id
+            FROM chat_sessions
+            GROUP BY user_id, session_name
+        ) keep ON keep.user_id = dup.user_id AND keep.session_name = dup.session_name
+        WHERE m.chat_id = dup.id AND dup.id <> keep.id;
+        """,
+        """
+        DELETE FROM chat_sessions dup
+        USING chat_sessions keep
+        WHERE dup.user_id = keep.user_id
+          AND dup.session_name = keep.session_name
+          AND dup.id > keep.id;
+        """,
+        """
+        ALTER TABLE chat_sessions
+        ADD CONSTRAINT uq_chat_sessions_user_session UNIQUE (user_id, session_name);
+        """,
+    ]),
+    (4, "partition messages by month + archive table", [
+        partition_messages,
+        """
+        CREATE TABLE IF NOT EXISTS messages_archive(
+            partition_name TEXT PRIMARY KEY,
+            range_start DATE NOT NULL,
+            range_end DATE NOT NULL,
+            row_count INT NOT NULL,
+            payload BYTEA NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """,
+    ]),
+    (5, "local calendar event store", [
+        # Google events mirrored per calendar; kept current by services.calendar_sync
+        """
+        CREATE TABLE IF NOT EXISTS calendar_events(
+            user_id INT NOT NULL,
+            calendar_id TEXT NOT NULL,
+            event_id TEXT NOT NULL,
+            summary TEXT,
+            start_at TIMESTAMPTZ,
+            end_at TIMESTAMPTZ,
+            all_day BOOLEAN NOT NULL DEFAULT FALSE,
+            payload JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, calendar_id, event_id),
+            CONSTRAINT fk_event_user FOREIGN KEY(user_id) REFERENCES app_users(id) ON DELETE CASCADE
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_calendar_events_start ON calendar_events (user_id, calendar_id, start_at);",
+        """
+        CREATE TABLE IF NOT EXISTS calendar_sync_state(
+            user_id INT NOT NULL,
+            calendar_id TEXT NOT NULL,
+            sync_token TEXT,
+            synced_at TIMESTAMP,
+            PRIMARY KEY (user_id, calendar_id),
+            CONSTRAINT fk_sync_user FOREIGN KEY(user_id) REFERENCES app_users(id) ON DELETE CASCADE
+        );
+        """,
+    ]),
+    (6, "inbound webhook messages", [
+        # every message /webhook accepted, so nothing is lost if the worker pool dies mid-turn
+        """
+        CREATE TABLE IF NOT EXISTS inbound_messages(
+            id SERIAL PRIMARY KEY,
+            user_identifier VARCHAR(255) NOT NULL,
+            text TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            attempts INT NOT NULL DEFAULT 0,
+            response TEXT,
+            last_error TEXT,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP
+        );
+        """,
+        # recover_inbound_async: only unfinished rows are ever looked up by status
+        "CREATE INDEX IF NOT EXISTS idx_inbound_unfinished ON inbound_messages (id) WHERE status IN ('pending', 'processing');",
+    ]),
+    (7, "idempotency keys on inbound messages", [
+        # the provider's message id; a redelivered message hits the unique constraint
+        "ALTER TABLE inbound_messages ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(255);",
+        # 'webhook' rows are run by the inbound workers, 'chat' rows by the /chat request itself
+        "ALTER TABLE inbound_messages ADD COLUMN IF NOT EXISTS channel VARCHAR(20) NOT NULL DEFAULT 'webhook';",
+        """
+        ALTER TABLE inbound_messages
+        ADD CONSTRAINT uq_inbound_user_idempotency UNIQUE (user_identifier, idempotency_key);
+        """,
+    ]),
+    (8, "inbound message leases", [
+        # the worker pool that accepted or recovered the message owns it until lease_until;
+        # other processes only recover rows whose lease ran out
+        "ALTER TABLE inbound_messages ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(64);",
+        "ALTER TABLE inbound_messages ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP;",
+    ]),
+]
+
+# Arbitrary key so two processes starting at once don't migrate concurrently
+MIGRATION_LOCK_KEY = 7_210_001
+
+
+def _ensure_migrations_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations(
+            version INT PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+
+def get_applied_versions():
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            _ensure_migrations_table(cur)
+            cur.execute("SELECT version FROM schema_migrations ORDER BY version;")
+            versions = [row[0] for row in cur.fetchall()]
+            conn.commit()
+            return versions
+        finally:
+            cur.close()
+
+
+def run_migrations(target_version=None):
+    """
+    Applies every pending migration up to target_version (default: all).
+    Returns the list of versions applied by this call.
+    """
+    applied_now = []
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            _ensure_migrations_table(cur)
+            conn.commit()
+
+            for version, description, statements in MIGRATIONS:
+                if target_version is not None and version > target_version:
+                    break
+                cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_KEY,))
+                cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s;", (version,))
+                if cur.fetchone():
+                    conn.commit()
+                    continue
+                for statement in statements:
+                    if callable(statement):
+                        statement(cur)
+                    else:
+                        cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                    (version, description)
+                )
+                conn.commit()
+                applied_now.append(version)
+                print(f"Applied migration {version}: {description}")
+        except Exception as e:
+            conn.rollback()
+            print(f"Error applying migrations: {e}")
+            raise e
+        finally:
+            cur.close()
+    return applied_now
+
+
+# Hot path queries that must be served by an index: the SQL the app runs,
+# with dummy parameters (only the plan shape matters).
+HOT_PATH_QUERIES = {
+    "begin_turn": (BEGIN_TURN_SQL, {
+        'user_identifier': '+0', 'text': '', 'chat_name': 'WhatsApp_General',
+        'history_limit': 10, 'history_days': 90, 'service_name': 'google_calendar',
+    }),
+    "get_chat_history_as_text": (HISTORY_SQL, {
+        'chat_id': 1, 'history_days': 90, 'exclude_message_id': None, 'limit': 10,
+    }),
+    "get_user_messages": (USER_MESSAGES_SQL, {
+        'user_id': 1, 'chat_id': 1, 'history_days': 90, 'limit': 50,
+    }),
+    "get_local_events": (LOCAL_EVENTS_SQL, (1, "primary", "2025-01-01T00:00:00Z", "2025-01-01T00:00:00Z", None, None, 20)),
+    "get_or_create_chat": (CHAT_ID_SQL, (1, "WhatsApp_General")),
+}
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def check_query_plans():
+    """
+    EXPLAINs every HOT_PATH_QUERIES entry with sequential scans disabled
+    (tests/test_query_plans.py runs this against a real database).
+    If a plan still contains a Seq Scan the index it needs is missing.
+    Returns {query_name: [problems]} - empty lists mean everything is indexed.
+    """
+    problems = {}
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            # small test tables make seq scans the cheapest plan, so take them off the table
+            cur.execute("SET LOCAL enable_seqscan = off;")
+            for name, (query, params) in HOT_PATH_QUERIES.items():
+                cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                problems[name] = [
+                    f"Seq Scan on {node.get('Relation Name')}"
+                    for node in _plan_nodes(plan[0]["Plan"])
+                    if node.get("Node Type") == "Seq Scan"
+                ]
+        finally:
+            conn.rollback()
+            cur.close()
+    return problems
+
+
+if __name__ == "__main__":
+    # python -m database.migrations          -> apply pending migrations
+    # python -m database.migrations --check  -> fail if a hot path query seq scans
+    run_migrations()
+    if "--check" in sys.argv:
+        failed = {name: issues for name, issues in check_query_plans().items() if issues}
+        for name, issues in failed.items():
+            print(f"{name}: {', '.join(issues)}")
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,216 @@
+import gzip
+import json
+import os
+import re
+from datetime import date
+from .connection import get_connection
+
+# messages is range partitioned by month on created_at (migration 4).
+# One partition per month named messages_yYYYYmMM, plus messages_default as a safety net.
+PARTITION_MONTHS_AHEAD = int(os.getenv('MESSAGE_PARTITION_MONTHS_AHEAD', '3'))
+# Partitions whose whole month is older than this get moved to messages_archive
+ARCHIVE_AFTER_MONTHS = int(os.getenv('MESSAGE_ARCHIVE_AFTER_MONTHS', '12'))
+# History reads only look this far back, so they only touch recent partitions
+HISTORY_WINDOW_DAYS = int(os.getenv('MESSAGE_HISTORY_WINDOW_DAYS', '90'))
+
+_PARTITION_NAME = re.compile(r'^messages_y(\d{4})m(\d{2})$')
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _add_months(month, count):
+    index = month.year * 12 + (month.month - 1) + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"messages_y{month.year:04d}m{month.month:02d}"
+
+
+def _existing_partitions(cur):
+    cur.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = 'messages';
+    """)
+    return {row[0] for row in cur.fetchall()}
+
+
+def _create_month_partition(cur, month):
+    """
+    Creates the partition for `month`. Rows that already landed in
+    messages_default for that month are moved into it.
+    """
+    start, end = month, _add_months(month, 1)
+    name = partition_name(month)
+    cur.execute(
+        "SELECT COUNT(*) FROM messages_default WHERE created_at >= %s AND created_at < %s;",
+        (start, end)
+    )
+    stray_rows = cur.fetchone()[0]
+    if stray_rows:
+        cur.execute("""
+            CREATE TEMP TABLE _moved_messages ON COMMIT DROP AS
+            SELECT * FROM messages_default WHERE created_at >= %s AND created_at < %s;
+        """, (start, end))
+        cur.execute(
+            "DELETE FROM messages_default WHERE created_at >= %s AND created_at < %s;",
+            (start, end)
+        )
+    cur.execute(
+        f"CREATE TABLE {name} PARTITION OF messages FOR VALUES FROM (%s) TO (%s);",
+        (start, end)
+    )
+    if stray_rows:
+        cur.execute("INSERT INTO messages SELECT * FROM _moved_messages;")
+        cur.execute("DROP TABLE _moved_messages;")
+
+
+def ensure_partitions(cur, first_month=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Creates any missing monthly partition from first_month (default: this month) up to months_ahead."""
+    this_month = _month_start(date.today())
+    month = _month_start(first_month) if first_month else this_month
+    last = _add_months(this_month, months_ahead)
+    existing = _existing_partitions(cur)
+    created = []
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            _create_month_partition(cur, month)
+            created.append(name)
+        month = _add_months(month, 1)
+    return created
+
+
+def partition_messages(cur):
+    """
+    Migration 4: swaps the plain messages table for a partitioned one
+    and copies the existing rows across. Keeps the same id sequence.
+    """
+    cur.execute("ALTER TABLE messages RENAME TO messages_unpartitioned;")
+    cur.execute("ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey;")
+    cur.execute("DROP INDEX IF EXISTS idx_messages_chat_created;")
+    cur.execute("DROP INDEX IF EXISTS idx_messages_user_chat_created;")
+    cur.execute("""
+        CREATE TABLE messages(
+            id INT NOT NULL DEFAULT nextval('messages_id_seq'),
+            text TEXT NOT NULL,
+            is_from_bot BOOLEAN NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            user_id INT NOT NULL,
+            chat_id INT NOT NULL,
+
+            PRIMARY KEY (id, created_at),
+            CONSTRAINT fk_chat FOREIGN KEY(chat_id) REFERENCES chat_sessions(id) ON DELETE CASCADE,
+            CONSTRAINT fk_user FOREIGN KEY(user_id) REFERENCES app_users(id) ON DELETE CASCADE
+        ) PARTITION BY RANGE (created_at);
+    """)
+    cur.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT;")
+    cur.execute("CREATE INDEX idx_messages_chat_created ON messages (chat_id, created_at, id);")
+    cur.execute("CREATE INDEX idx_messages_user_chat_created ON messages (user_id, chat_id, created_at);")
+
+    cur.execute("SELECT MIN(created_at) FROM messages_unpartitioned;")
+    oldest = cur.fetchone()[0]
+    ensure_partitions(cur, first_month=oldest.date() if oldest else None)
+
+    cur.execute("""
+        INSERT INTO messages (id, text, is_from_bot, created_at, user_id, chat_id)
+        SELECT id, text, is_from_bot, COALESCE(created_at, CURRENT_TIMESTAMP), user_id, chat_id
+        FROM messages_unpartitioned;
+    """)
+    cur.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id;")
+    cur.execute("DROP TABLE messages_unpartitioned;")
+
+
+def archive_old_partitions(cur, older_than_months=ARCHIVE_AFTER_MONTHS):
+    """
+    Detaches monthly partitions that ended more than older_than_months ago,
+    stores their rows gzip-compressed in messages_archive and drops them.
+    Returns the archived partition names.
+    """
+    cutoff = _add_months(_month_start(date.today()), -older_than_months)
+    archived = []
+    for name in sorted(_existing_partitions(cur)):
+        match = _PARTITION_NAME.match(name)
+        if not match:
+            continue
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+        end = _add_months(month, 1)
+        if end > cutoff:
+            continue
+
+        cur.execute(f"ALTER TABLE messages DETACH PARTITION {name};")
+        cur.execute(f"SELECT id, text, is_from_bot, created_at, user_id, chat_id FROM {name} ORDER BY id;")
+        rows = [
+            {
+                "id": row[0], "text": row[1], "is_from_bot": row[2],
+                "created_at": row[3].isoformat(), "user_id": row[4], "chat_id": row[5],
+            }
+            for row in cur.fetchall()
+        ]
+        payload = gzip.compress(json.dumps(rows).encode('utf-8'))
+        cur.execute(
+            """
+            INSERT INTO messages_archive (partition_name, range_start, range_end, row_count, payload)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (partition_name) DO NOTHING;
+            """,
+            (name, month, end, len(rows), payload)
+        )
+        if cur.rowcount == 0:
+            # an archive of that name already exists: keep the rows rather than drop them unarchived
+            print(f"Partition {name} already has an archive, not dropping it")
+            cur.execute(
+                f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s);",
+                (month, end)
+            )
+            continue
+        cur.execute(f"DROP TABLE {name};")
+        archived.append(name)
+    return archived
+
+
+def load_archived_messages(partition_name):
+    """Reads an archived month back as a list of message dicts"""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT payload FROM messages_archive WHERE partition_name = %s;", (partition_name,))
+            result = cur.fetchone()
+            if not result:
+                return []
+            return json.loads(gzip.decompress(bytes(result[0])).decode('utf-8'))
+        finally:
+            cur.close()
+
+
+def run_partition_maintenance(months_ahead=PARTITION_MONTHS_AHEAD, archive_after_months=ARCHIVE_AFTER_MONTHS, archive=True):
+    """
+    Creates upcoming monthly partitions and (with archive=True) archives old ones.
+    The API only creates partitions on startup; archiving is a scheduled job
+    (e.g. a daily cron: python -m database.partitions).
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            created = ensure_partitions(cur, months_ahead=months_ahead)
+            conn.commit()
+            archived = archive_old_partitions(cur, older_than_months=archive_after_months) if archive else []
+            conn.commit()
+            if created or archived:
+                print(f"Partition maintenance: created {created}, archived {archived}")
+            return {"created": created, "archived": archived}
+        except Exception as e:
+            conn.rollback()
+            print(f"Error in partition maintenance: {e}")
+            return {"created": [], "archived": [], "error": str(e)}
+        finally:
+            cur.close()
+
+
+if __name__ == "__main__":
+    run_partition_maintenance()
@@ -1,60 +1,57 @@
+import asyncio
+import concurrent.futures
+import os
+import time
 from google import genai
 from google.genai import types
 # Note: We are importing the logic, but we will pass user_id dynamically now
-from services.calendar_service import create_calendar, list_calendar_list, list_calendar_events, insert_calendar_event, get_today_date
+from services.calendar_service import create_calendar, list_calendar_list, list_calendar_events, insert_calendar_event, insert_calendar_events_bulk, find_free_slots, list_all_calendar_events
 from model.gemini_auth import client
 
-from utils.functionTools import (
-    create_calendar_function,
-    create_calendar_event_function,
-    list_calendar_events_function,
-    list_calendar_list_function
-)
+from services.gemini_config import ConfigRegistry, GEMINI_MODEL
+from services.tool_projection import project_tool_result
 
-def create_chat_session(client_start, raw_history):
-    """Create a new chat session with the Gemini model."""
-    tools = types.Tool(function_declarations=[
-        create_calendar_function,
-        create_calendar_event_function,
-        list_calendar_events_function,
-        list_calendar_list_function,
-    ])    
-    current_date = get_today_date()
-
-    system_instruction = f"""
-        You are a calendar assistant for a user in the Asia/Jerusalem timezone.
-
-        IMPORTANT DATE HANDLING:
-        Today's date is {current_date}. When users say:
-        - "today" -> use {current_date}
-        - "tomorrow" -> calculate tomorrow's date
-        
-        Format: YYYY-MM-DDTHH:MM:SS+02:00
-        
-        If a calendar name seems incomplete, list calendars first then ask.
-        """
+# System prompt + tools, built once per day instead of once per message
+config_registry = ConfigRegistry(client)
+
+# Tool rounds per user message (each round = one extra Gemini call)
+TOOL_MAX_STEPS = int(os.getenv('GEMINI_TOOL_MAX_STEPS', '5'))
+TOOL_DEADLINE_SECONDS = float(os.getenv('GEMINI_TOOL_DEADLINE_SECONDS', '60'))
+TOOL_WORKERS = int(os.getenv('GEMINI_TOOL_WORKERS', '8'))
+# Calendar tools block on HTTP, so parallel calls run here
+_tool_pool = concurrent.futures.ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+# Tools that change the user's calendars. A timed out call keeps running on the
+# pool and may still succeed, so the model must not be told it simply failed.
+MUTATING_TOOLS = {'create_calendar', 'insert_calendar_event', 'insert_calendar_events_bulk'}
 
-    config = types.GenerateContentConfig(
-        tools=[tools],
-        system_instruction=system_instruction
-    )    
+def create_chat_session(client_start, raw_history, config=None):
+    """Create a new chat session with the Gemini model."""
+    config = config or config_registry.get_config()
     
     gemini_history = raw_history
     
     chatGemini = client_start.chats.create(
-        model="gemini-2.5-flash", 
+        model=GEMINI_MODEL, 
         config=config,
         history=gemini_history
     )
     return chatGemini
 
+async def create_chat_session_async(client_start, raw_history, config=None):
+    """Same as create_chat_session but on the async client (client.aio)."""
+    return client_start.aio.chats.create(
+        model=GEMINI_MODEL,
+        config=config or await config_registry.get_config_async(),
+        history=raw_history
+    )
+
 def process_function_call(user_id, function_call):
     """
     Process a function call.
     IMPORTANT: We now pass user_id to every calendar function.
     """
     function_response_data = None
-    args = dict(function_call.args)
+    args = dict(function_call.args or {})
     
     # Inject user_id into the arguments for the calendar service
     args['user_id'] = user_id
@@ -66,6 +63,15 @@ def process_function_call(user_id, function_call):
         elif function_call.name == 'insert_calendar_event':
             function_response_data = insert_calendar_event(**args)
 
+        elif function_call.name == 'insert_calendar_events_bulk':
+            function_response_data = insert_calendar_events_bulk(**args)
+
+        elif function_call.name == 'find_free_slots':
+            function_response_data = find_free_slots(**args)
+
+        elif function_call.name == 'list_all_calendar_events':
+            function_response_data = list_all_calendar_events(**args)
+
         elif function_call.name == 'list_calendar_events':
             my_events = list_calendar_events(**args)
             function_response_data = {"my_events": my_events}
@@ -78,42 +84,222 @@ def process_function_call(user_id, function_call):
     except Exception as e:
         function_response_data = {"error": str(e)}
     
-    return function_response_data
+    # only the fields the model needs go back to Gemini
+    return project_tool_result(function_call.name, function_response_data)
+
+
+def _calls_info(function_calls):
+    return [{"name": call.name, "args": dict(call.args or {})} for call in function_calls]
+
+
+def _function_info(calls_info):
+    """What the API reports: the first call (as before) plus every call made this turn."""
+    if not calls_info:
+        return None
+    return {**calls_info[0], "calls": calls_info}
+
+
+def _response_part(function_call, function_response_data):
+    if function_response_data is None:
+        function_response_data = {"error": f"Could not execute function {function_call.name}"}
+    return types.Part.from_function_response(
+        name=function_call.name,
+        response=function_response_data
+    )
+
+
+def _skipped_parts(function_calls, reason):
+    """Answers calls we won't run, so the chat history stays valid and the model can still reply."""
+    return [_response_part(call, {"error": f"Not executed: {reason}. Answer with what you have."})
+            for call in function_calls]
+
 
+def _timed_out(call):
+    """Result for a call still running at the deadline"""
+    if call.name in MUTATING_TOOLS:
+        return {"status": "unknown",
+                "error": f"{call.name} is still running and may still succeed. "
+                         "Do not retry it; tell the user to check their calendar."}
+    return {"error": f"{call.name} timed out"}
 
-def send_message(chat_session, user_message, user_id):
+
+def _run_function_calls(user_id, function_calls, deadline):
+    """Runs every call of one model step concurrently on the tool pool."""
+    futures = [_tool_pool.submit(process_function_call, user_id, call) for call in function_calls]
+    parts = []
+    for call, future in zip(function_calls, futures):
+        try:
+            data = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except concurrent.futures.TimeoutError:
+            data = _timed_out(call)
+        except Exception as e:
+            # every call needs a response or the session's history is broken
+            data = {"error": str(e)}
+        parts.append(_response_part(call, data))
+    return parts
+
+
+def send_message(chat_session, user_message, user_id, max_steps=TOOL_MAX_STEPS, deadline_seconds=TOOL_DEADLINE_SECONDS):
     """
     Send a message and handle function calls.
     ADDED: user_id argument to pass to tools.
+    Every function call in a response runs (in parallel) and all the results go back
+    in one message; repeats while the model keeps calling tools, up to max_steps
+    tool rounds / deadline_seconds. Gemini errors are raised, not turned into a reply.
     """
+    deadline = time.monotonic() + deadline_seconds
     response = chat_session.send_message(user_message)
-    
+    calls_info = []
+
     try:
-        part = response.candidates[0].content.parts[0]
-        
-        if part.function_call:
-            function_call = part.function_call
-            
-            function_call_info = {
-                "name": function_call.name,
-                "args": dict(function_call.args)
-            }
-            
-            function_response_data = process_function_call(user_id, function_call)
-            
-            if function_response_data is not None:
-                function_response_part = types.Part.from_function_response(
-                    name=function_call.name,
-                    response=function_response_data
-                )
-                # Send the tool output back to Gemini
-                response = chat_session.send_message(function_response_part)
-                return response.text, function_call_info
+        steps = 0
+        while response.function_calls:
+            function_calls = response.function_calls
+            calls_info.extend(_calls_info(function_calls))
+
+            if steps >= max_steps:
+                parts = _skipped_parts(function_calls, "tool step limit reached")
+            elif time.monotonic() >= deadline:
+                parts = _skipped_parts(function_calls, "time limit reached")
             else:
-                return f"Error: Could not execute function {function_call.name}", function_call_info
-        else:
-            return response.text, None
-            
+                parts = _run_function_calls(user_id, function_calls, deadline)
+            steps += 1
+
+            # Send the tool outputs back to Gemini
+            response = chat_session.send_message(parts)
+            if steps > max_steps:
+                break
+
+        if response.function_calls:
+            return "Sorry, that request needed too many steps. Could you break it up?", _function_info(calls_info)
+        return response.text, _function_info(calls_info)
+
     except Exception as e:
+        # the session may now end in an unanswered function call: the caller
+        # has to drop it, and the turn must not be stored as answered
         print(f"Error in send_message: {e}")
-        return "Sorry, something went wrong processing your request.", None
\ No newline at end of file
+        raise
+
+
+async def _run_function_calls_async(user_id, function_calls, deadline):
+    loop = asyncio.get_running_loop()
+    futures = [loop.run_in_executor(_tool_pool, process_function_call, user_id, call) for call in function_calls]
+    await asyncio.wait(futures, timeout=max(deadline - time.monotonic(), 0))
+    parts = []
+    for call, future in zip(function_calls, futures):
+        if future.done() and not future.exception():
+            data = future.result()
+        elif future.done():
+            data = {"error": str(future.exception())}
+        else:
+            data = _timed_out(call)
+        parts.append(_response_part(call, data))
+    return parts
+
+
+async def send_message_async(chat_session, user_message, user_id, max_steps=TOOL_MAX_STEPS, deadline_seconds=TOOL_DEADLINE_SECONDS):
+    """
+    Async send_message for sessions made by create_chat_session_async.
+    The calendar tools use the blocking googleapiclient, so they run on the tool thread pool.
+    """
+    deadline = time.monotonic() + deadline_seconds
+    response = await chat_session.send_message(user_message)
+    calls_info = []
+
+    try:
+        steps = 0
+        while response.function_calls:
+            function_calls = response.function_calls
+            calls_info.extend(_calls_info(function_calls))
+
+            if steps >= max_steps:
+                parts = _skipped_parts(function_calls, "tool step limit reached")
+            elif time.monotonic() >= deadline:
+                parts = _skipped_parts(function_calls, "time limit reached")
+            else:
+                parts = await _run_function_calls_async(user_id, function_calls, deadline)
+            steps += 1
+
+            response = await chat_session.send_message(parts)
+            if steps > max_steps:
+                break
+
+        if response.function_calls:
+            return "Sorry, that request needed too many steps. Could you break it up?", _function_info(calls_info)
+        return response.text, _function_info(calls_info)
+
+    except Exception as e:
+        # the session may now end in an unanswered function call: the caller
+        # has to drop it, and the turn must not be stored as answered
+        print(f"Error in send_message_async: {e}")
+        raise
+
+
+def _chunk_text(chunk):
+    """Text of one streamed chunk (without the SDK warning about non-text parts)"""
+    if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+        return ""
+    return "".join(part.text for part in chunk.candidates[0].content.parts if part.text and not part.thought)
+
+
+async def send_message_stream(chat_session, user_message, user_id, max_steps=TOOL_MAX_STEPS, deadline_seconds=TOOL_DEADLINE_SECONDS):
+    """
+    Streaming send_message_async. Async generator of (event, data):
+    - ("text", str)          a piece of the reply as Gemini produces it
+    - ("tool_call", dict)    a calendar function is about to run
+    - ("tool_result", dict)  it finished ({"name", "ok"})
+    - ("done", dict)         last event: {"text": full reply, "function_info"}
+    - ("error", dict)        last event instead of "done" when Gemini or a tool
+                             round failed: {"text": apology, "function_info"};
+                             the session's history is then unreliable
+    The full reply is all text streamed, over every tool round.
+    Tool rounds follow the same limits as send_message_async.
+    """
+    deadline = time.monotonic() + deadline_seconds
+    calls_info = []
+    message = user_message
+    steps = 0
+    text_parts = []
+
+    try:
+        while True:
+            function_calls = []
+            async for chunk in await chat_session.send_message_stream(message):
+                if chunk.function_calls:
+                    function_calls.extend(chunk.function_calls)
+                text = _chunk_text(chunk)
+                if text:
+                    text_parts.append(text)
+                    yield "text", text
+
+            if not function_calls:
+                yield "done", {"text": "".join(text_parts), "function_info": _function_info(calls_info)}
+                return
+            if steps > max_steps:
+                text = "Sorry, that request needed too many steps. Could you break it up?"
+                text_parts.append(text)
+                yield "text", text
+                yield "done", {"text": "".join(text_parts), "function_info": _function_info(calls_info)}
+                return
+
+            calls_info.extend(_calls_info(function_calls))
+            if steps >= max_steps:
+                parts = _skipped_parts(function_calls, "tool step limit reached")
+            elif time.monotonic() >= deadline:
+                parts = _skipped_parts(function_calls, "time limit reached")
+            else:
+                for call in function_calls:
+                    yield "tool_call", {"name": call.name, "args": dict(call.args or {})}
+                parts = await _run_function_calls_async(user_id, function_calls, deadline)
+                for part in parts:
+                    result = part.function_response.response or {}
+                    yield "tool_result", {"name": part.function_response.name, "ok": "error" not in result}
+            steps += 1
+            message = parts
+
+    except Exception as e:
+        print(f"Error in send_message_stream: {e}")
+        yield "error", {
+            "text": "Sorry, something went wrong processing your request.",
+            "function_info": _function_info(calls_info),
+        }
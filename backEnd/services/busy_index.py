@@ -0,0 +1,59 @@
+from bisect import bisect_right
+from datetime import timedelta
+
+
+class BusyIndex:
+    """
+    Busy time as sorted, non-overlapping intervals (aware datetimes).
+    Overlapping/touching input intervals are merged on construction, so
+    conflict checks and gap searches are a bisect plus a short scan.
+    """
+
+    def __init__(self, intervals=()):
+        # intervals: iterable of (start, end) or (start, end, label)
+        self.starts = []
+        self.ends = []
+        self.labels = []  # labels of the source intervals folded into each merged one
+        for interval in sorted(intervals, key=lambda item: item[0]):
+            start, end = interval[0], interval[1]
+            label = interval[2] if len(interval) > 2 else None
+            if end <= start:
+                continue
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+                if label:
+                    self.labels[-1].append(label)
+                continue
+            self.starts.append(start)
+            self.ends.append(end)
+            self.labels.append([label] if label else [])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _first_ending_after(self, moment):
+        # ends are sorted because the intervals are disjoint
+        return bisect_right(self.ends, moment)
+
+    def conflicts(self, start, end):
+        """Merged busy intervals overlapping [start, end): [(start, end, [labels])]"""
+        found = []
+        i = self._first_ending_after(start)
+        while i < len(self.starts) and self.starts[i] < end:
+            found.append((self.starts[i], self.ends[i], self.labels[i]))
+            i += 1
+        return found
+
+    def free_between(self, start, end, min_length=timedelta(0)):
+        """Gaps of at least min_length inside [start, end): [(start, end)]"""
+        gaps = []
+        cursor = start
+        i = self._first_ending_after(start)
+        while i < len(self.starts) and self.starts[i] < end:
+            if self.starts[i] - cursor >= min_length and self.starts[i] > cursor:
+                gaps.append((cursor, self.starts[i]))
+            cursor = max(cursor, self.ends[i])
+            i += 1
+        if end - cursor >= min_length and end > cursor:
+            gaps.append((cursor, end))
+        return gaps
@@ -0,0 +1,98 @@
+import difflib
+import os
+import re
+import time
+from utils.ttl_cache import TTLCache
+
+# Per-user calendarList cache. Entries go stale after CALENDAR_CACHE_TTL and are
+# then revalidated with the list's ETag, so an unchanged list costs a 304 only.
+CALENDAR_CACHE_TTL = float(os.getenv('CALENDAR_CACHE_TTL', '300'))
+CALENDAR_CACHE_SIZE = int(os.getenv('CALENDAR_CACHE_SIZE', '5000'))
+# How close a name must be for a fuzzy match (difflib ratio)
+CALENDAR_FUZZY_CUTOFF = float(os.getenv('CALENDAR_FUZZY_CUTOFF', '0.75'))
+
+
+def normalize_calendar_name(name):
+    """'  Work-Cal ' -> 'work cal'"""
+    return re.sub(r'[\W_]+', ' ', (name or '').lower()).strip()
+
+
+class CalendarIndex:
+    """A user's calendars plus case-insensitive and fuzzy name lookups."""
+
+    def __init__(self, calendars, etag=None):
+        self.calendars = calendars  # [{'id', 'name', 'description'}] as list_calendar_list returns
+        self.etag = etag
+        self.fetched_at = time.monotonic()
+        self._by_lower = {}
+        self._by_normalized = {}
+        for calendar in calendars:
+            name = calendar.get('name') or ''
+            self._by_lower.setdefault(name.lower(), calendar['id'])
+            self._by_normalized.setdefault(normalize_calendar_name(name), calendar['id'])
+
+    def is_fresh(self, ttl=CALENDAR_CACHE_TTL):
+        return time.monotonic() - self.fetched_at < ttl
+
+    def touch(self):
+        """The server said the list didn't change"""
+        self.fetched_at = time.monotonic()
+
+    def names(self):
+        return [calendar['name'] for calendar in self.calendars]
+
+    def name_of(self, calendar_id):
+        return next((calendar['name'] for calendar in self.calendars if calendar['id'] == calendar_id), None)
+
+    def resolve_exact(self, calendar_name):
+        """Like resolve() but only case/punctuation-insensitive matches, no guessing"""
+        if not calendar_name:
+            return None
+        return self._by_lower.get(calendar_name.lower()) or self._by_normalized.get(normalize_calendar_name(calendar_name))
+
+    def resolve(self, calendar_name):
+        """
+        Calendar id for a name the user/model typed, or None. May guess (word
+        or fuzzy match), so it is for reads; writes use resolve_exact().
+        """
+        if not calendar_name:
+            return None
+        calendar_id = self._by_lower.get(calendar_name.lower())
+        if calendar_id:
+            return calendar_id
+
+        wanted = normalize_calendar_name(calendar_name)
+        calendar_id = self._by_normalized.get(wanted)
+        if calendar_id:
+            return calendar_id
+
+        # "work" -> "Work Calendar" when it is the only calendar containing it
+        containing = [key for key in self._by_normalized if wanted and wanted in key.split()]
+        if len(containing) == 1:
+            return self._by_normalized[containing[0]]
+
+        close = difflib.get_close_matches(wanted, list(self._by_normalized), n=1, cutoff=CALENDAR_FUZZY_CUTOFF)
+        if close:
+            return self._by_normalized[close[0]]
+        return None
+
+
+# user_id -> CalendarIndex. No TTL here: stale entries are kept for their ETag.
+_calendar_indexes = TTLCache(maxsize=CALENDAR_CACHE_SIZE, ttl=None)
+
+
+def get_cached_index(user_id):
+    return _calendar_indexes.get(user_id)
+
+
+def store_index(user_id, index):
+    _calendar_indexes.set(user_id, index)
+
+
+def invalidate_calendar_cache(user_id):
+    """Call after anything that changes the user's calendar list"""
+    _calendar_indexes.pop(user_id)
+
+
+def get_calendar_cache_stats():
+    return _calendar_indexes.stats()
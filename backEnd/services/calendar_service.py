@@ -1,10 +1,29 @@
+import heapq
 import json 
+import os
+from concurrent.futures import ThreadPoolExecutor
+from googleapiclient.errors import HttpError
 from utils.api_auth import create_google_calendar_service
-from datetime import datetime, timedelta, date
+from services.calendar_cache import CalendarIndex, get_cached_index, store_index, invalidate_calendar_cache
+from services.calendar_sync import sync_calendar, sync_horizon, EVENT_FIELDS
+from services.busy_index import BusyIndex
+from database.calendar_store import get_local_events, save_local_events, get_busy_intervals, get_sync_state
+from datetime import datetime, timedelta, date, time
+from zoneinfo import ZoneInfo
 
 # DELETED: Global client_secret and global service construction.
 # These cannot exist globally in a multi-user app.
 
+# Cross-calendar searches query calendars concurrently on this many threads
+# (the service object is safe to share: each thread gets its own Http)
+CALENDAR_FANOUT_WORKERS = int(os.getenv('CALENDAR_FANOUT_WORKERS', '8'))
+_fanout_pool = ThreadPoolExecutor(max_workers=CALENDAR_FANOUT_WORKERS, thread_name_prefix="calendar-fanout")
+
+# Partial-response masks: only the parts of each resource we read or hand to
+# the model. Attendees, conferenceData, per-item etags etc. are never downloaded.
+CALENDAR_LIST_FIELDS = 'etag,nextPageToken,items(id,summary,description)'
+EVENT_LIST_FIELDS = f'nextPageToken,items({EVENT_FIELDS})'
+
 def get_service(user_id):
     """Helper to get authorized service for a specific user"""
     return create_google_calendar_service(user_id, 'calendar', 'v3')
@@ -16,34 +35,43 @@ def create_calendar(user_id, name):
 
     calendar_list = {'summary': name}
     created_calendar = service.calendars().insert(body=calendar_list).execute()
+    invalidate_calendar_cache(user_id)
     return created_calendar
 
 def get_CalenderId(user_id, calender_name):
-    # We reuse list_calendar_list but pass the user_id
-    allCalenders = list_calendar_list(user_id)
-    for calender in allCalenders:
-        if calender['name'].lower() == calender_name.lower(): # Added case-insensitivity
-            return calender['id']
-    return None
- 
-def list_calendar_list(user_id, max_capacity=200):
-    """List calendars for the specific user."""
-    service = get_service(user_id)
-    if not service: return []
+    # Resolved from the cached calendar list (case-insensitive, then fuzzy)
+    index = get_calendar_index(user_id)
+    if index is None:
+        return None
+    return index.resolve(calender_name)
 
-    if isinstance(max_capacity, str):
-        max_capacity = int(max_capacity)
-        
+def _fetch_calendar_list(service, max_capacity=200, etag=None):
+    """
+    Pages through calendarList. Returns (calendars, etag), or (None, etag)
+    when the server answered 304 to our If-None-Match.
+    """
     all_calendars = []
     all_calendars_cleaned = []
     next_page_token = None
     capacity_tracker = 0
+    list_etag = None
 
     while True:
-        calendar_list = service.calendarList().list(
+        request = service.calendarList().list(
             maxResults=min(200, max_capacity - capacity_tracker),
-            pageToken=next_page_token
-        ).execute()
+            pageToken=next_page_token,
+            fields=CALENDAR_LIST_FIELDS
+        )
+        if etag and next_page_token is None:
+            request.headers['If-None-Match'] = etag
+        try:
+            calendar_list = request.execute()
+        except HttpError as e:
+            if e.resp.status == 304:
+                return None, etag
+            raise
+        if list_etag is None:
+            list_etag = calendar_list.get('etag')
         calendars = calendar_list.get('items', [])
         all_calendars.extend(calendars)
         capacity_tracker += len(calendars)
@@ -59,78 +87,395 @@ def list_calendar_list(user_id, max_capacity=200):
             'name': calendar.get('summary'),
             'description': calendar.get('description', ''),
         })
-    return all_calendars_cleaned
+    return all_calendars_cleaned, list_etag
+
+def get_calendar_index(user_id, force_refresh=False):
+    """
+    The user's calendars from the per-user cache. When the entry is stale it is
+    revalidated with its ETag; a 304 just marks it fresh again.
+    Returns a CalendarIndex or None if the user can't be authenticated.
+    """
+    index = get_cached_index(user_id)
+    if index is not None and not force_refresh and index.is_fresh():
+        return index
 
-def list_calendar_events(user_id, calendar_name, max_capacity=20):
-    """List events for specific user and calendar."""
     service = get_service(user_id)
-    if not service: return []
+    if not service:
+        return None
+
+    calendars, etag = _fetch_calendar_list(service, max_capacity=250, etag=index.etag if index else None)
+    if calendars is None:
+        index.touch()
+        return index
+
+    index = CalendarIndex(calendars, etag)
+    store_index(user_id, index)
+    return index
+ 
+def list_calendar_list(user_id, max_capacity=200):
+    """List calendars for the specific user."""
+    if isinstance(max_capacity, str):
+        max_capacity = int(max_capacity)
+
+    index = get_calendar_index(user_id)
+    if index is None: return []
+    return [dict(calendar) for calendar in index.calendars[:max_capacity]]
 
+def list_calendar_events(user_id, calendar_name, max_capacity=20, time_min=None, time_max=None, time_zone='Asia/Jerusalem'):
+    """
+    List events for specific user and calendar, ordered by start.
+    Only events overlapping [time_min, time_max) are returned; without a
+    time_min the list starts now instead of at the oldest event.
+    Served from the local event store, which is synced incrementally first;
+    windows starting before the store's horizon are read from Google.
+    """
     if isinstance(max_capacity, str):
         max_capacity = int(max_capacity)
 
+    try:
+        tz = ZoneInfo(time_zone)
+        window_start = _parse_time(time_min, tz) if time_min else datetime.now(tz)
+        window_end = _parse_time(time_max, tz, end_of_day=True) if time_max else None
+    except Exception as e:
+        return [{"error": f"Date format error: {e}"}]
+
     calendar_id = get_CalenderId(user_id, calendar_name)
     if not calendar_id:
         return [{"error": f"Calendar {calendar_name} not found"}]
 
-    all_events = []
-    next_page_token = None
-    capacity_tracker = 0
-    
-    while True:
-        events_list = service.events().list(
-            calendarId=calendar_id,
-            maxResults=min(250, max_capacity - capacity_tracker),
-            pageToken=next_page_token
-        ).execute()
-        events = events_list.get('items', [])
-        all_events.extend(events)
-        capacity_tracker += len(events)
-        if capacity_tracker >= max_capacity:
-            break
-        next_page_token = events_list.get('nextPageToken')
-        if not next_page_token:
-            break
-    return all_events
-
-def insert_calendar_event(user_id, calendar_name, summary, start_datetime, description=None, end_datetime=None, time_zone='Asia/Jerusalem', **kwargs):
-    """Insert event for specific user."""
     service = get_service(user_id)
-    if not service: return {"error": "Could not authenticate user"}
+    if not service: return []
 
-    try: 
-        calendar_id = get_CalenderId(user_id, calendar_name)
-        if not calendar_id:
-             # If not found, return available ones to help the AI
-            available = list_calendar_list(user_id)
-            names = [c['name'] for c in available]
-            return {"error": f"Calendar '{calendar_name}' not found.", "available_calendars": names}
-    except Exception as e:
-        return {"error": str(e)}
-    
-    if end_datetime is None:
+    if window_start < sync_horizon():
         try:
-            # Handle timezone removal safely
-            clean_start = start_datetime.split('+')[0]
-            start_dt = datetime.fromisoformat(clean_start)
-            end_dt = start_dt + timedelta(hours=1)
-            end_datetime = end_dt.isoformat() + '+02:00'
+            return _list_window(service, calendar_id, window_start.isoformat(),
+                                window_end.isoformat() if window_end else None, max_capacity)
         except Exception as e:
-             return {"error": f"Date format error: {e}"}
-        
-    event = {
+            return [{"error": f"Google API Error: {e}"}]
+
+    synced = sync_calendar(service, user_id, calendar_id) != "error"
+    events = get_local_events(user_id, calendar_id, limit=max_capacity, time_min=window_start, time_max=window_end)
+    if not synced and not events:
+        return [{"error": f"Could not load events of {calendar_name}"}]
+    return events
+
+def _calendar_not_found(index, calendar_name):
+    """
+    Error for a write to a calendar name that isn't an exact match. Writes never
+    guess; the closest calendar is only suggested so the model can ask the user.
+    """
+    error = {"error": f"Calendar '{calendar_name}' not found.", "available_calendars": index.names()}
+    suggestion = index.resolve(calendar_name)
+    if suggestion:
+        error["did_you_mean"] = index.name_of(suggestion)
+    return error
+
+def _event_body(summary, start_datetime, end_datetime=None, description=None, time_zone='Asia/Jerusalem'):
+    """Google event resource; events without an end last one hour"""
+    if end_datetime is None:
+        # keeps the UTC offset the model gave us
+        end_datetime = (datetime.fromisoformat(start_datetime) + timedelta(hours=1)).isoformat()
+    return {
         'summary': summary,
         'description': description,
         'start': {'dateTime': start_datetime, 'timeZone': time_zone},
         'end': {'dateTime': end_datetime, 'timeZone': time_zone},
     }
+
+def insert_calendar_event(user_id, calendar_name, summary, start_datetime, description=None, end_datetime=None, time_zone='Asia/Jerusalem', **kwargs):
+    """Insert event for specific user."""
+    try: 
+        index = get_calendar_index(user_id)
+        if index is None: return {"error": "Could not authenticate user"}
+        calendar_id = index.resolve_exact(calendar_name)
+        if not calendar_id:
+             # If not found, return available ones to help the AI (same cached list, no extra API call)
+            return _calendar_not_found(index, calendar_name)
+    except Exception as e:
+        return {"error": str(e)}
+
+    service = get_service(user_id)
+    if not service: return {"error": "Could not authenticate user"}
+    
+    try:
+        event = _event_body(summary, start_datetime, end_datetime, description, time_zone)
+    except Exception as e:
+        return {"error": f"Date format error: {e}"}
     event.update(kwargs)
     
+    conflicts = find_conflicts(user_id, start_datetime, event['end']['dateTime'], time_zone,
+                               service=service, calendar_id=calendar_id)
+
     try:
         created_event = service.events().insert(calendarId=calendar_id, body=event).execute()
-        return created_event
     except Exception as e:
         return {"error": f"Google API Error: {e}"}
+    save_local_events(user_id, calendar_id, [created_event])
+    if conflicts is None:
+        created_event = dict(created_event, conflicts="unknown: the calendar's events could not be loaded")
+    elif conflicts:
+        created_event = dict(created_event, conflicts=conflicts)
+    return created_event
+
+# Google accepts up to 50 calls in one Calendar batch request
+BATCH_LIMIT = 50
+
+def insert_calendar_events_bulk(user_id, calendar_name, events, time_zone='Asia/Jerusalem'):
+    """
+    Inserts many events into one calendar through Google's batch endpoint
+    (one HTTP round trip per 50 events). Every event is reported on its own:
+    {"created": [...], "errors": [{"index", "summary", "error"}], "created_count", "error_count"}
+    """
+    index = get_calendar_index(user_id)
+    if index is None: return {"error": "Could not authenticate user"}
+    calendar_id = index.resolve_exact(calendar_name)
+    if not calendar_id:
+        return _calendar_not_found(index, calendar_name)
+
+    service = get_service(user_id)
+    if not service: return {"error": "Could not authenticate user"}
+
+    created = []
+    errors = []
+    bodies = []
+    for position, item in enumerate(events or []):
+        try:
+            body = _event_body(
+                item['summary'],
+                item['start_datetime'],
+                item.get('end_datetime'),
+                item.get('description'),
+                item.get('time_zone', time_zone),
+            )
+            bodies.append((position, body))
+        except Exception as e:
+            errors.append({"index": position, "summary": item.get('summary') if isinstance(item, dict) else None, "error": f"Invalid event: {e}"})
+
+    answered = set()  # positions whose batch callback already ran
+
+    def on_response(request_id, response, exception):
+        position = int(request_id)
+        answered.add(position)
+        if exception is not None:
+            summary = next(body['summary'] for p, body in bodies if p == position)
+            errors.append({"index": position, "summary": summary, "error": f"Google API Error: {exception}"})
+        else:
+            created.append({"index": position, **response})
+
+    for start in range(0, len(bodies), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=on_response)
+        for position, body in bodies[start:start + BATCH_LIMIT]:
+            batch.add(service.events().insert(calendarId=calendar_id, body=body), request_id=str(position))
+        try:
+            batch.execute()
+        except Exception as e:
+            # callbacks that already ran have reported their event
+            for position, body in bodies[start:start + BATCH_LIMIT]:
+                if position not in answered:
+                    errors.append({"index": position, "summary": body['summary'], "error": f"Google API Error: {e}"})
+
+    save_local_events(user_id, calendar_id, [{k: v for k, v in event.items() if k != 'index'} for event in created])
+    created.sort(key=lambda event: event['index'])
+    errors.sort(key=lambda error: error['index'])
+    return {
+        "created": created,
+        "errors": errors,
+        "created_count": len(created),
+        "error_count": len(errors),
+    }
+
+def _parse_time(value, tz, end_of_day=False):
+    """ISO date or datetime -> aware datetime ('2025-10-31' means the start, or end, of that day)"""
+    if isinstance(value, datetime):
+        moment = value
+    elif len(value) == 10:
+        day = date.fromisoformat(value)
+        moment = datetime.combine(day + timedelta(days=1) if end_of_day else day, time())
+    else:
+        moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=tz)
+    return moment
+
+def find_conflicts(user_id, start_datetime, end_datetime, time_zone='UTC', service=None, calendar_id=None):
+    """
+    Stored events overlapping a time range, from the local event store.
+    Returns [{"start", "end", "events": [summaries]}].
+    With service and calendar_id that calendar is synced first (usually one
+    incremental call); if it was never synced and can't be, the answer is
+    unknown and None is returned instead of an empty list.
+    """
+    try:
+        tz = ZoneInfo(time_zone)
+        start = _parse_time(start_datetime, tz)
+        end = _parse_time(end_datetime, tz)
+    except Exception:
+        return []
+    if service is not None and calendar_id:
+        if sync_calendar(service, user_id, calendar_id) == "error" and get_sync_state(user_id, calendar_id) is None:
+            return None
+    index = BusyIndex(get_busy_intervals(user_id, start, end))
+    return [
+        {"start": busy_start.astimezone(tz).isoformat(), "end": busy_end.astimezone(tz).isoformat(), "events": labels}
+        for busy_start, busy_end, labels in index.conflicts(start, end)
+    ]
+
+# freebusy takes at most 50 calendars per query
+FREEBUSY_LIMIT = 50
+
+def find_free_slots(user_id, time_min, time_max, duration_minutes=30, work_start="09:00", work_end="18:00",
+                    calendar_names=None, time_zone='Asia/Jerusalem', max_slots=10):
+    """
+    Free time of at least duration_minutes inside working hours, across the
+    given calendars (default: all of them). Busy times come from one freebusy
+    query and are merged into a BusyIndex before the gaps are collected.
+    """
+    if isinstance(duration_minutes, str):
+        duration_minutes = int(duration_minutes)
+    if isinstance(max_slots, str):
+        max_slots = int(max_slots)
+
+    index = get_calendar_index(user_id)
+    if index is None: return {"error": "Could not authenticate user"}
+
+    if calendar_names:
+        calendar_ids = []
+        for name in calendar_names:
+            calendar_id = index.resolve(name)
+            if not calendar_id:
+                return {"error": f"Calendar '{name}' not found.", "available_calendars": index.names()}
+            calendar_ids.append(calendar_id)
+    else:
+        calendar_ids = [calendar['id'] for calendar in index.calendars]
+
+    try:
+        tz = ZoneInfo(time_zone)
+        range_start = _parse_time(time_min, tz)
+        range_end = _parse_time(time_max, tz, end_of_day=True)
+        day_start = time.fromisoformat(work_start)
+        day_end = time.fromisoformat(work_end)
+    except Exception as e:
+        return {"error": f"Date format error: {e}"}
+
+    service = get_service(user_id)
+    if not service: return {"error": "Could not authenticate user"}
+
+    busy = []
+    errors = []
+    for start in range(0, len(calendar_ids), FREEBUSY_LIMIT):
+        body = {
+            "timeMin": range_start.isoformat(),
+            "timeMax": range_end.isoformat(),
+            "timeZone": time_zone,
+            "items": [{"id": calendar_id} for calendar_id in calendar_ids[start:start + FREEBUSY_LIMIT]],
+        }
+        try:
+            result = service.freebusy().query(body=body).execute()
+        except Exception as e:
+            return {"error": f"Google API Error: {e}"}
+        for calendar_id, calendar in result.get('calendars', {}).items():
+            if calendar.get('errors'):
+                errors.append({"calendar_id": calendar_id, "errors": calendar['errors']})
+            for period in calendar.get('busy', []):
+                busy.append((datetime.fromisoformat(period['start']), datetime.fromisoformat(period['end'])))
+
+    busy_index = BusyIndex(busy)
+    duration = timedelta(minutes=duration_minutes)
+    slots = []
+    day = range_start.astimezone(tz).date()
+    while len(slots) < max_slots:
+        window_start = max(datetime.combine(day, day_start, tz), range_start)
+        window_end = min(datetime.combine(day, day_end, tz), range_end)
+        if window_start >= range_end:
+            break
+        if window_start < window_end:
+            for gap_start, gap_end in busy_index.free_between(window_start, window_end, duration):
+                slots.append({
+                    "start": gap_start.astimezone(tz).isoformat(),
+                    "end": gap_end.astimezone(tz).isoformat(),
+                    "minutes": int((gap_end - gap_start).total_seconds() // 60),
+                })
+                if len(slots) >= max_slots:
+                    break
+        day += timedelta(days=1)
+
+    response = {"free_slots": slots, "busy_periods": len(busy_index)}
+    if errors:
+        response["calendar_errors"] = errors
+    return response
+
+def _event_start_key(event, tz):
+    """Sort key for an event: all-day events start at midnight in tz"""
+    start = event.get('start') or {}
+    return _parse_time(start.get('dateTime') or start.get('date'), tz)
+
+def _list_window(service, calendar_id, time_min, time_max, max_capacity):
+    """One calendar's events inside the window, ordered by start (Google does the sorting)"""
+    events = []
+    next_page_token = None
+    while len(events) < max_capacity:
+        response = service.events().list(
+            calendarId=calendar_id,
+            timeMin=time_min,
+            timeMax=time_max,
+            singleEvents=True,
+            orderBy='startTime',
+            maxResults=min(250, max_capacity - len(events)),
+            pageToken=next_page_token,
+            fields=EVENT_LIST_FIELDS
+        ).execute()
+        events.extend(response.get('items', []))
+        next_page_token = response.get('nextPageToken')
+        if not next_page_token:
+            break
+    return events[:max_capacity]
+
+def list_all_calendar_events(user_id, time_min, time_max, max_per_calendar=50, time_zone='Asia/Jerusalem'):
+    """
+    Events from every calendar of the user inside [time_min, time_max),
+    merged into one list ordered by start. The calendars are queried
+    concurrently, so this takes about as long as the slowest one.
+    """
+    if isinstance(max_per_calendar, str):
+        max_per_calendar = int(max_per_calendar)
+
+    index = get_calendar_index(user_id)
+    if index is None: return {"error": "Could not authenticate user"}
+
+    try:
+        tz = ZoneInfo(time_zone)
+        window_start = _parse_time(time_min, tz).isoformat()
+        window_end = _parse_time(time_max, tz, end_of_day=True).isoformat()
+    except Exception as e:
+        return {"error": f"Date format error: {e}"}
+
+    service = get_service(user_id)
+    if not service: return {"error": "Could not authenticate user"}
+
+    futures = [
+        (calendar, _fanout_pool.submit(_list_window, service, calendar['id'], window_start, window_end, max_per_calendar))
+        for calendar in index.calendars
+    ]
+
+    per_calendar = []
+    errors = []
+    for calendar, future in futures:
+        try:
+            events = future.result()
+        except Exception as e:
+            errors.append({"calendar": calendar['name'], "error": f"Google API Error: {e}"})
+            continue
+        per_calendar.append([
+            (_event_start_key(event, tz), position, dict(event, calendar=calendar['name']))
+            for position, event in enumerate(events)
+        ])
+
+    # every list is already sorted by start, so a k-way merge is enough
+    merged = [event for _, _, event in heapq.merge(*per_calendar, key=lambda item: item[0])]
+    response = {"events": merged}
+    if errors:
+        response["calendar_errors"] = errors
+    return response
 
 def get_today_date():
     return date.today().strftime("%Y-%m-%d")
\ No newline at end of file
@@ -0,0 +1,118 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from googleapiclient.errors import HttpError
+from database.calendar_store import get_sync_state, apply_sync
+from utils.keyed_lock import KeyedLock
+
+# Google events are mirrored into calendar_events and kept current with
+# incremental events.list calls (syncToken). A calendar is synced at most once
+# per CALENDAR_SYNC_MIN_INTERVAL; reads in between are local queries only.
+CALENDAR_SYNC_MIN_INTERVAL = float(os.getenv('CALENDAR_SYNC_MIN_INTERVAL', '60'))
+# A full sync only mirrors events ending after now - this many days, so it
+# doesn't page through a calendar's whole history on the request path.
+# Older windows are read from Google directly (see sync_horizon).
+CALENDAR_SYNC_LOOKBACK_DAYS = int(os.getenv('CALENDAR_SYNC_LOOKBACK_DAYS', '90'))
+# Largest page Google allows for events.list
+SYNC_PAGE_SIZE = 2500
+# Partial response: the event fields we store, read or hand to the model
+# (also used by calendar_service for its direct events.list calls)
+EVENT_FIELDS = 'id,status,summary,description,location,start,end,transparency,htmlLink,recurringEventId'
+SYNC_FIELDS = f'nextPageToken,nextSyncToken,items({EVENT_FIELDS})'
+
+# one sync at a time per (user_id, calendar_id)
+_calendar_lock = KeyedLock()
+_stats_lock = threading.Lock()
+_stats = {
+    "skipped": 0,
+    "incremental": 0,
+    "full": 0,
+    "token_expired": 0,
+    "errors": 0,
+    "events_received": 0,
+}
+
+
+def _count(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+
+def sync_horizon():
+    """Events ending before this are not in the local store"""
+    return datetime.now(timezone.utc) - timedelta(days=CALENDAR_SYNC_LOOKBACK_DAYS)
+
+
+def _fetch_changes(service, calendar_id, sync_token=None):
+    """
+    Pages through events.list. Without a token this is a full listing from
+    sync_horizon() on, with one Google returns only what changed (cancelled
+    events included). Returns (events, next_sync_token).
+    """
+    events = []
+    page_token = None
+    while True:
+        params = {
+            'calendarId': calendar_id,
+            'singleEvents': True,
+            'maxResults': SYNC_PAGE_SIZE,
+            'pageToken': page_token,
+            'fields': SYNC_FIELDS,
+        }
+        if sync_token:
+            params['syncToken'] = sync_token
+        else:
+            # the sync token keeps this bound for the incremental calls
+            params['timeMin'] = sync_horizon().isoformat()
+        response = service.events().list(**params).execute()
+        events.extend(response.get('items', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return events, response.get('nextSyncToken')
+
+
+def sync_calendar(service, user_id, calendar_id, force=False):
+    """
+    Brings the local copy of one calendar up to date.
+    Returns "fresh" (synced recently, nothing done), "incremental", "full"
+    or "error" (local data, if any, is left as it was).
+    """
+    with _calendar_lock((user_id, calendar_id)):
+        state = get_sync_state(user_id, calendar_id)
+        if (state and state["sync_token"] and not force
+                and state["age_seconds"] is not None and state["age_seconds"] < CALENDAR_SYNC_MIN_INTERVAL):
+            _count("skipped")
+            return "fresh"
+
+        sync_token = state["sync_token"] if state else None
+        try:
+            if sync_token:
+                try:
+                    events, next_token = _fetch_changes(service, calendar_id, sync_token)
+                    full = False
+                except HttpError as e:
+                    if e.resp.status != 410:
+                        raise
+                    # token expired or invalidated by Google - start over; the
+                    # stored events stay until the full listing replaces them
+                    _count("token_expired")
+                    sync_token = None
+            if not sync_token:
+                events, next_token = _fetch_changes(service, calendar_id)
+                full = True
+        except Exception as e:
+            _count("errors")
+            print(f"Error syncing calendar {calendar_id} for user {user_id}: {e}")
+            return "error"
+
+        if not apply_sync(user_id, calendar_id, events, next_token, full=full):
+            _count("errors")
+            return "error"
+        _count("events_received", len(events))
+        _count("full" if full else "incremental")
+        return "full" if full else "incremental"
+
+
+def get_calendar_sync_stats():
+    with _stats_lock:
+        return dict(_stats)
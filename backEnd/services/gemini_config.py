@@ -0,0 +1,241 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from google.genai import types
+
+from utils.functionTools import (
+    create_calendar_function,
+    create_calendar_event_function,
+    list_calendar_events_function,
+    list_calendar_list_function,
+    create_calendar_events_bulk_function,
+    find_free_slots_function,
+    list_all_calendar_events_function
+)
+
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+DEFAULT_TIMEZONE = os.getenv('ASSISTANT_TIMEZONE', 'Asia/Jerusalem')
+# Put the system prompt + tool schema in a provider side cached content
+# instead of sending them with every request
+GEMINI_CONTEXT_CACHE = os.getenv('GEMINI_CONTEXT_CACHE', '0') == '1'
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv('GEMINI_CONTEXT_CACHE_TTL', '3600'))
+
+# name -> function declarations offered to the model
+TOOLSETS = {
+    "calendar": (
+        create_calendar_function,
+        create_calendar_event_function,
+        list_calendar_events_function,
+        list_calendar_list_function,
+        create_calendar_events_bulk_function,
+        find_free_slots_function,
+        list_all_calendar_events_function,
+    ),
+}
+
+SYSTEM_INSTRUCTION_TEMPLATE = """
+        You are a calendar assistant for a user in the {timezone} timezone.
+
+        IMPORTANT DATE HANDLING:
+        Today's date is {current_date}. When users say:
+        - "today" -> use {current_date}
+        - "tomorrow" -> calculate tomorrow's date
+        
+        Format: YYYY-MM-DDTHH:MM:SS{utc_offset}
+        
+        If a calendar name seems incomplete, list calendars first then ask.
+        """
+
+
+def today_in(timezone=DEFAULT_TIMEZONE):
+    """YYYY-MM-DD in the given timezone"""
+    return datetime.now(ZoneInfo(timezone)).strftime("%Y-%m-%d")
+
+
+def _utc_offset(timezone):
+    offset = datetime.now(ZoneInfo(timezone)).strftime("%z")  # e.g. +0300
+    return f"{offset[:3]}:{offset[3:]}"
+
+
+class ConfigRegistry:
+    """
+    Builds each GenerateContentConfig once per (date, timezone, toolset)
+    instead of on every message. The types.Tool per toolset is built once.
+
+    With use_context_cache the static preamble (system instruction + tools)
+    is stored with client.caches.create and the config only references it.
+    If the provider refuses (e.g. prompt under the minimum cacheable size)
+    we fall back to the inline config. The network call runs outside the
+    registry lock, once per key (concurrent callers wait for that build);
+    get_config_async uses client.aio.caches.create so the event loop never blocks.
+
+    A config is replaced shortly before its context cache expires, so callers
+    holding on to one (e.g. cached chat sessions) should compare it with the
+    current get_config() result and rebuild when it changed.
+
+    `client` only needs `caches.create(model=..., config=...)` (and
+    `aio.caches.create` for the async path), so a fake works in tests.
+    """
+
+    def __init__(self, client, model=GEMINI_MODEL, use_context_cache=GEMINI_CONTEXT_CACHE,
+                 context_cache_ttl=GEMINI_CONTEXT_CACHE_TTL):
+        self.client = client
+        self.model = model
+        self.use_context_cache = use_context_cache
+        self.context_cache_ttl = context_cache_ttl
+        self._tools = {}
+        self._configs = {}  # key -> (config, expires_at or None)
+        self._lock = threading.Lock()
+        self._building = {}  # key -> threading.Lock held while that key is built
+        self._building_async = {}  # key -> asyncio future of the build in progress
+        self.builds = 0
+        self.hits = 0
+        self.context_caches_created = 0
+        self.context_cache_failures = 0
+
+    def get_tool(self, toolset="calendar"):
+        tool = self._tools.get(toolset)
+        if tool is None:
+            tool = types.Tool(function_declarations=list(TOOLSETS[toolset]))
+            self._tools[toolset] = tool
+        return tool
+
+    def system_instruction(self, current_date, timezone):
+        return SYSTEM_INSTRUCTION_TEMPLATE.format(
+            timezone=timezone,
+            current_date=current_date,
+            utc_offset=_utc_offset(timezone),
+        )
+
+    def _cache_request(self, instruction, tool, current_date, timezone, toolset):
+        return dict(
+            model=self.model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"{toolset}-{timezone}-{current_date}",
+                system_instruction=instruction,
+                tools=[tool],
+                ttl=f"{self.context_cache_ttl}s",
+            ),
+        )
+
+    def _cached_config(self, cached):
+        self.context_caches_created += 1
+        # refresh a minute before the provider drops it
+        expires_at = time.monotonic() + max(self.context_cache_ttl - 60, 0)
+        return types.GenerateContentConfig(cached_content=cached.name), expires_at
+
+    def _inline_config(self, instruction, tool, error):
+        self.context_cache_failures += 1
+        print(f"Context cache unavailable, sending the prompt inline: {error}")
+        return types.GenerateContentConfig(tools=[tool], system_instruction=instruction), None
+
+    def _build(self, current_date, timezone, toolset):
+        tool = self.get_tool(toolset)
+        instruction = self.system_instruction(current_date, timezone)
+        if not self.use_context_cache:
+            return types.GenerateContentConfig(tools=[tool], system_instruction=instruction), None
+        try:
+            cached = self.client.caches.create(
+                **self._cache_request(instruction, tool, current_date, timezone, toolset))
+        except Exception as e:
+            return self._inline_config(instruction, tool, e)
+        return self._cached_config(cached)
+
+    async def _build_async(self, current_date, timezone, toolset):
+        tool = self.get_tool(toolset)
+        instruction = self.system_instruction(current_date, timezone)
+        if not self.use_context_cache:
+            return types.GenerateContentConfig(tools=[tool], system_instruction=instruction), None
+        try:
+            cached = await self.client.aio.caches.create(
+                **self._cache_request(instruction, tool, current_date, timezone, toolset))
+        except Exception as e:
+            return self._inline_config(instruction, tool, e)
+        return self._cached_config(cached)
+
+    def _key(self, current_date, timezone, toolset):
+        return (current_date or today_in(timezone), timezone, toolset)
+
+    def _lookup(self, key):
+        """The stored config for key if it is still fresh, else None"""
+        with self._lock:
+            entry = self._configs.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self.hits += 1
+                return entry[0]
+            return None
+
+    def _store(self, key, config, expires_at):
+        with self._lock:
+            # only today's configs are worth keeping
+            for old_key in [k for k in self._configs if k[0] != key[0]]:
+                del self._configs[old_key]
+            self._configs[key] = (config, expires_at)
+            self.builds += 1
+
+    def get_config(self, current_date=None, timezone=DEFAULT_TIMEZONE, toolset="calendar"):
+        key = self._key(current_date, timezone, toolset)
+        config = self._lookup(key)
+        if config is not None:
+            return config
+        with self._lock:
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            # another thread may have built it while we waited
+            config = self._lookup(key)
+            if config is not None:
+                return config
+            try:
+                config, expires_at = self._build(*key)
+                self._store(key, config, expires_at)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+            return config
+
+    async def get_config_async(self, current_date=None, timezone=DEFAULT_TIMEZONE, toolset="calendar"):
+        """get_config for the event loop: the context cache is created on client.aio"""
+        key = self._key(current_date, timezone, toolset)
+        while True:
+            config = self._lookup(key)
+            if config is not None:
+                return config
+            pending = self._building_async.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # the building caller was cancelled, not us: build it ourselves
+                if not pending.cancelled():
+                    raise
+        pending = asyncio.get_running_loop().create_future()
+        self._building_async[key] = pending
+        try:
+            config, expires_at = await self._build_async(*key)
+            self._store(key, config, expires_at)
+            pending.set_result(config)
+            return config
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            # nobody may be waiting on it
+            pending.exception()
+            raise
+        finally:
+            self._building_async.pop(key, None)
+
+    def stats(self):
+        return {
+            "configs": len(self._configs),
+            "builds": self.builds,
+            "hits": self.hits,
+            "context_cache": self.use_context_cache,
+            "context_caches_created": self.context_caches_created,
+            "context_cache_failures": self.context_cache_failures,
+        }
@@ -0,0 +1,29 @@
+import os
+from utils.ttl_cache import TTLCache
+
+# Reply text of recent messages, keyed by (user_identifier, message_id), so a
+# provider redelivering a message gets the same answer without another turn.
+# Only finished, successful turns are remembered (from /chat and /webhook alike),
+# a failed one may be delivered and run again.
+# The unique constraint on inbound_messages catches what this cache misses
+# (other processes, restarts, evictions).
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_CACHE_TTL = float(os.getenv('IDEMPOTENCY_CACHE_TTL', '86400'))
+
+_recent = TTLCache(maxsize=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_CACHE_TTL)
+
+
+def cached_response(user_identifier, message_id):
+    """The reply text we sent for this message before, or None"""
+    if not message_id:
+        return None
+    return _recent.get((user_identifier, message_id))
+
+
+def remember_response(user_identifier, message_id, response_text):
+    if message_id:
+        _recent.set((user_identifier, message_id), response_text or "")
+
+
+def get_idempotency_stats():
+    return _recent.stats()
@@ -0,0 +1,220 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+from database.inbound_messages import mark_inbound_processing_async, finish_inbound_async, recover_inbound_async
+from services.outbound import get_outbound_sender
+from services.turn_dispatcher import TurnQueueFull
+
+# Background processing for /webhook: the endpoint persists the message and
+# returns, these workers run the turn and send the reply.
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '8'))
+# Attempts per turn (and per reply delivery) before the message is marked failed
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '3'))
+# First retry delay in seconds, doubled on every further attempt
+WEBHOOK_RETRY_DELAY = float(os.getenv('WEBHOOK_RETRY_DELAY', '2'))
+# How long a process owns the messages it accepted; after that (the process
+# died) another one may recover them. Must be longer than a turn takes.
+WEBHOOK_LEASE_SECONDS = float(os.getenv('WEBHOOK_LEASE_SECONDS', '600'))
+# How often to look for messages whose owner's lease ran out
+WEBHOOK_RECOVER_INTERVAL = float(os.getenv('WEBHOOK_RECOVER_INTERVAL', '60'))
+
+
+class InboundWorkerPool:
+    """
+    A fixed number of asyncio workers draining a queue of accepted messages.
+    handler(request) runs one turn and returns the reply text, or None when
+    there is nothing to send (e.g. the message was coalesced into a later one).
+    make_request(user_identifier, text) rebuilds a request for recovered rows.
+    on_done(request, reply), if given, runs once a message finished successfully.
+
+    Messages are owned by one pool at a time (owner id + lease in the table):
+    /webhook inserts them with this pool as owner, and the recovery loop only
+    claims rows whose owner's lease ran out.
+    A user's messages occupy at most one worker: messages arriving while one of
+    theirs is in a worker wait in that user's backlog (not on the turn lane, where
+    they'd park a worker each) and are run by that worker next, together, so
+    the coalescer can still fold them into one turn.
+    Only failures in retry_on (raised before the turn stored anything, e.g.
+    TurnQueueFull) are retried; after begin_turn ran, a retry would store the
+    message again and could repeat calendar writes, so the message fails.
+    """
+
+    def __init__(self, handler, make_request, workers=WEBHOOK_WORKERS, max_attempts=WEBHOOK_MAX_ATTEMPTS,
+                 retry_delay=WEBHOOK_RETRY_DELAY, sender_factory=get_outbound_sender,
+                 lease_seconds=WEBHOOK_LEASE_SECONDS, recover_interval=WEBHOOK_RECOVER_INTERVAL,
+                 retry_on=(TurnQueueFull,), on_done=None):
+        self.handler = handler
+        self.make_request = make_request
+        self.on_done = on_done
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        self.recover_interval = recover_interval
+        self.retry_on = retry_on
+        self.owner = uuid.uuid4().hex
+        self._sender_factory = sender_factory
+        self.sender = None
+        self._queue = None
+        self._backlogs = {}  # user_id -> deque of items waiting for that user's worker
+        self._tasks = []
+        self._retry_tasks = set()
+
+        # stats
+        self._in_progress = 0
+        self._done = 0
+        self._failed = 0
+        self._retries = 0
+        self._recovered = 0
+        self._deferred = 0
+        self._send_failures = 0
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._dequeued = 0
+
+    async def start(self, recover=True):
+        """Starts the workers; re-queues messages a dead process accepted but never finished"""
+        self._queue = asyncio.Queue()
+        self.sender = self._sender_factory()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if recover:
+            await self.recover()
+            self._tasks.append(asyncio.create_task(self._recover_loop()))
+
+    async def recover(self):
+        """Claims and queues messages whose owner's lease ran out"""
+        try:
+            rows = await recover_inbound_async(self.owner, self.lease_seconds)
+        except Exception as e:
+            print(f"Error recovering inbound messages: {e}")
+            return
+        for inbound_id, user_identifier, text, _ in rows:
+            self._recovered += 1
+            self.submit(inbound_id, self.make_request(user_identifier, text))
+
+    async def _recover_loop(self):
+        while True:
+            await asyncio.sleep(self.recover_interval)
+            await self.recover()
+
+    async def stop(self):
+        for task in [*self._tasks, *self._retry_tasks]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._retry_tasks, return_exceptions=True)
+        self._tasks = []
+        self._retry_tasks = set()
+        if self.sender is not None:
+            await self.sender.close()
+
+    def submit(self, inbound_id, request, attempt=0):
+        self._queue.put_nowait((inbound_id, request, time.monotonic(), attempt))
+
+    def _retry_later(self, inbound_id, request, attempt):
+        async def requeue():
+            await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            self.submit(inbound_id, request, attempt)
+
+        task = asyncio.create_task(requeue())
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                user_key = item[1].user_id
+                backlog = self._backlogs.get(user_key)
+                if backlog is not None:
+                    # another worker is on this user; it picks this up next
+                    backlog.append(item)
+                    self._deferred += 1
+                    continue
+                backlog = self._backlogs[user_key] = deque([item])
+                try:
+                    while backlog:
+                        items = list(backlog)
+                        backlog.clear()
+                        # started in order, so the turns keep the user's message order
+                        await asyncio.gather(*(self._run(*item) for item in items))
+                finally:
+                    del self._backlogs[user_key]
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, inbound_id, request, enqueued_at, attempt):
+        lag = time.monotonic() - enqueued_at
+        self._dequeued += 1
+        self._lag_total += lag
+        self._lag_max = max(self._lag_max, lag)
+        self._in_progress += 1
+        try:
+            await self._process(inbound_id, request, attempt)
+        except Exception as e:
+            print(f"Inbound worker error on message {inbound_id}: {e}")
+        finally:
+            self._in_progress -= 1
+
+    async def _process(self, inbound_id, request, attempt):
+        # start the turn before any await, so a user's messages enter the
+        # turn dispatcher in the order they were dequeued
+        turn = asyncio.ensure_future(self.handler(request))
+        attempt += 1
+        try:
+            await mark_inbound_processing_async(inbound_id, self.lease_seconds)
+        except Exception as e:
+            print(f"Error marking inbound message {inbound_id}: {e}")
+        try:
+            reply = await turn
+        except Exception as e:
+            if isinstance(e, self.retry_on) and attempt < self.max_attempts:
+                self._retries += 1
+                await finish_inbound_async(inbound_id, 'pending', last_error=str(e))
+                self._retry_later(inbound_id, request, attempt)
+            else:
+                self._failed += 1
+                await finish_inbound_async(inbound_id, 'failed', last_error=str(e))
+            return
+
+        if reply:
+            error = await self._send(request.user_id, reply)
+            if error:
+                self._failed += 1
+                await finish_inbound_async(inbound_id, 'failed', response=reply, last_error=f"send failed: {error}")
+                return
+        self._done += 1
+        await finish_inbound_async(inbound_id, 'done', response=reply)
+        if self.on_done is not None:
+            self.on_done(request, reply)
+
+    async def _send(self, user_identifier, text):
+        """Delivers a reply, retrying with backoff. Returns the last error or None."""
+        error = None
+        for send_attempt in range(self.max_attempts):
+            if send_attempt:
+                await asyncio.sleep(self.retry_delay * 2 ** (send_attempt - 1))
+            try:
+                await self.sender.send(user_identifier, text)
+                return None
+            except Exception as e:
+                self._send_failures += 1
+                error = e
+        return str(error)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "waiting_retry": len(self._retry_tasks),
+            "in_progress": self._in_progress,
+            "done": self._done,
+            "failed": self._failed,
+            "retries": self._retries,
+            "recovered": self._recovered,
+            "deferred": self._deferred,
+            "busy_users": len(self._backlogs),
+            "send_failures": self._send_failures,
+            "avg_queue_lag_ms": (self._lag_total / self._dequeued * 1000) if self._dequeued else 0.0,
+            "max_queue_lag_ms": self._lag_max * 1000,
+        }
@@ -0,0 +1,155 @@
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from services.calendar_service import list_calendar_events, get_calendar_index
+
+# Trivial requests ("show my calendars", "what's on my Work calendar") are
+# answered straight from the calendar tools with a template reply, skipping
+# both Gemini round trips. Anything not matched with confidence goes to Gemini.
+INTENT_ROUTER = os.getenv('INTENT_ROUTER', '1') == '1'
+INTENT_EVENTS_SHOWN = int(os.getenv('INTENT_EVENTS_SHOWN', '10'))
+INTENT_TIMEZONE = os.getenv('ASSISTANT_TIMEZONE', 'Asia/Jerusalem')
+
+LIST_CALENDARS_PATTERNS = [
+    re.compile(r"(please )?(show|list|get|give|tell)( me)? (all )?(of )?(my|the) calendars( please)?"),
+    re.compile(r"(what|which) calendars (do i have|have i got|are there)"),
+    re.compile(r"(all )?my calendars"),
+]
+LIST_EVENTS_PATTERNS = [
+    re.compile(r"(what s|whats|what is|what do i have) (on|in) (my )?(the )?(?P<name>.+?) calendar"),
+    re.compile(r"(please )?(show|list|get)( me)? (the )?(events|meetings|schedule) (on|in|of|from) (my )?(the )?(?P<name>.+?)( calendar)?"),
+    re.compile(r"(please )?(show|list|get)( me)? (my )?(?P<name>.+?) calendar events"),
+]
+
+
+def _normalize(text):
+    """'What's on my Work calendar?!' -> "what s on my work calendar" """
+    return re.sub(r"[^\w]+", " ", text.lower()).strip()
+
+
+def _when(value, tz):
+    """Event start/end dict -> 'Mon 19 Oct 10:00' (or 'Mon 19 Oct' for all-day)"""
+    if 'dateTime' in value:
+        return datetime.fromisoformat(value['dateTime']).astimezone(tz).strftime('%a %d %b %H:%M')
+    return datetime.fromisoformat(value['date']).strftime('%a %d %b') + " (all day)"
+
+
+def _render_calendars(calendars):
+    if not calendars:
+        return "You don't have any calendars yet."
+    lines = [f"You have {len(calendars)} calendar{'s' if len(calendars) != 1 else ''}:"]
+    lines += [f"• {calendar['name']}" for calendar in calendars]
+    return "\n".join(lines)
+
+
+def _render_events(calendar_name, events, tz):
+    if not events:
+        return f"Nothing coming up on {calendar_name}."
+    lines = [f"Coming up on {calendar_name}:"]
+    for event in events:
+        start = _when(event.get('start') or {}, tz)
+        end = event.get('end') or {}
+        until = f"–{datetime.fromisoformat(end['dateTime']).astimezone(tz).strftime('%H:%M')}" if 'dateTime' in end else ""
+        lines.append(f"• {start}{until} {event.get('summary') or '(no title)'}")
+    return "\n".join(lines)
+
+
+def _list_calendars(user_id, match):
+    index = get_calendar_index(user_id)
+    if index is None:
+        # no credentials or auth failed - not the same as having no calendars
+        return None
+    calendars = [dict(calendar) for calendar in index.calendars]
+    return _render_calendars(calendars), {"name": "list_calendar_list", "args": {}}
+
+
+def _list_events(user_id, match):
+    index = get_calendar_index(user_id)
+    if index is None:
+        return None
+    wanted = match.group('name')
+    calendar_id = index.resolve_exact(wanted)
+    if not calendar_id:
+        # not sure which calendar is meant - let Gemini ask
+        return None
+    calendar_name = next(c['name'] for c in index.calendars if c['id'] == calendar_id)
+    events = list_calendar_events(user_id, calendar_name, max_capacity=INTENT_EVENTS_SHOWN)
+    if any('error' in event for event in events):
+        return None
+    args = {"calendar_name": calendar_name}
+    return _render_events(calendar_name, events, ZoneInfo(INTENT_TIMEZONE)), {"name": "list_calendar_events", "args": args}
+
+
+# route name -> (patterns, handler(user_id, match) -> (reply, call) or None to fall through)
+ROUTES = {
+    "list_calendars": (LIST_CALENDARS_PATTERNS, _list_calendars),
+    "list_events": (LIST_EVENTS_PATTERNS, _list_events),
+}
+
+_stats_lock = threading.Lock()
+_stats = {"messages": 0, "routed": 0, "routes": {}}
+
+
+def _record(route, outcome, elapsed):
+    with _stats_lock:
+        entry = _stats["routes"].setdefault(route, {"hits": 0, "fallbacks": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        entry[outcome] += 1
+        entry["total_ms"] += elapsed * 1000
+        entry["max_ms"] = max(entry["max_ms"], elapsed * 1000)
+        if outcome == "hits":
+            _stats["routed"] += 1
+
+
+def route_message(user_id, text):
+    """
+    (reply, function_info) when the message is one of the routes we answer
+    locally, else None. Blocking (calendar tools), so async callers run it in a thread.
+    """
+    if not INTENT_ROUTER:
+        return None
+    with _stats_lock:
+        _stats["messages"] += 1
+
+    normalized = _normalize(text)
+    for route, (patterns, handler) in ROUTES.items():
+        match = next((m for m in (p.fullmatch(normalized) for p in patterns) if m), None)
+        if match is None:
+            continue
+        started = time.monotonic()
+        try:
+            result = handler(user_id, match)
+        except Exception as e:
+            print(f"Intent route {route} failed, falling back to Gemini: {e}")
+            _record(route, "errors", time.monotonic() - started)
+            return None
+        if result is None:
+            _record(route, "fallbacks", time.monotonic() - started)
+            return None
+        _record(route, "hits", time.monotonic() - started)
+        reply, call = result
+        return reply, {**call, "calls": [call], "route": route}
+    return None
+
+
+def get_intent_router_stats():
+    with _stats_lock:
+        routes = {
+            route: {
+                "hits": entry["hits"],
+                "fallbacks": entry["fallbacks"],
+                "errors": entry["errors"],
+                "avg_ms": entry["total_ms"] / max(entry["hits"] + entry["fallbacks"] + entry["errors"], 1),
+                "max_ms": entry["max_ms"],
+            }
+            for route, entry in _stats["routes"].items()
+        }
+        return {
+            "enabled": INTENT_ROUTER,
+            "messages": _stats["messages"],
+            "routed": _stats["routed"],
+            "hit_rate": _stats["routed"] / _stats["messages"] if _stats["messages"] else 0.0,
+            "routes": routes,
+        }
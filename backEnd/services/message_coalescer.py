@@ -0,0 +1,108 @@
+import asyncio
+import os
+import time
+
+# WhatsApp users often split one request over several quick messages.
+# With a window set, messages from the same user that arrive less than
+# MESSAGE_COALESCE_WINDOW seconds apart are answered together with one
+# turn. 0 turns coalescing off.
+MESSAGE_COALESCE_WINDOW = float(os.getenv('MESSAGE_COALESCE_WINDOW', '0'))
+# A burst is flushed after this long even if messages keep coming
+MESSAGE_COALESCE_MAX_WAIT = float(os.getenv('MESSAGE_COALESCE_MAX_WAIT', str(MESSAGE_COALESCE_WINDOW * 3)))
+
+
+class _Burst:
+    def __init__(self, loop, reservation=None):
+        self.reservation = reservation
+        self.requests = []
+        self.first_at = time.monotonic()
+        self.last_at = self.first_at
+        self.result = loop.create_future()
+        self.task = None  # the flush; kept so it can't be garbage collected mid-burst
+
+
+class MessageCoalescer:
+    """
+    Per-user debounce in front of the chat pipeline.
+
+        result, answered = await coalescer.submit(user_key, request)
+
+    Every request of a burst waits for the same handler(requests, reservation)
+    call. Only the newest request gets answered=True; the others were folded into it.
+
+    reserve(user_key), if given, runs when a message starts a new burst and its
+    result is handed to the handler (e.g. a turn_dispatcher.turn); its release()
+    is called after the flush, so a reservation the handler never entered (the
+    flush was cancelled, or failed first) is given back. If it raises
+    (TurnQueueFull), only that message's submit() fails and no burst is started;
+    messages joining an existing burst ride on its reservation.
+    """
+
+    def __init__(self, handler, window=MESSAGE_COALESCE_WINDOW, max_wait=MESSAGE_COALESCE_MAX_WAIT, reserve=None):
+        self.handler = handler
+        self.reserve = reserve
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self._bursts = {}
+
+        # stats
+        self._messages = 0
+        self._flushes = 0
+        self._largest_burst = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    async def submit(self, user_key, request):
+        burst = self._bursts.get(user_key)
+        if burst is None:
+            reservation = self.reserve(user_key) if self.reserve is not None else None
+            burst = self._bursts[user_key] = _Burst(asyncio.get_running_loop(), reservation)
+            burst.task = asyncio.create_task(self._flush_when_quiet(user_key, burst))
+        burst.requests.append(request)
+        burst.last_at = time.monotonic()
+        self._messages += 1
+
+        # shielded: one caller going away must not cancel the turn for the others
+        result = await asyncio.shield(burst.result)
+        return result, request is burst.requests[-1]
+
+    async def _flush_when_quiet(self, user_key, burst):
+        try:
+            while True:
+                now = time.monotonic()
+                remaining = min(burst.last_at + self.window, burst.first_at + self.max_wait) - now
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+
+            # later messages start a new burst
+            del self._bursts[user_key]
+            self._flushes += 1
+            self._largest_burst = max(self._largest_burst, len(burst.requests))
+            try:
+                burst.result.set_result(await self.handler(list(burst.requests), burst.reservation))
+            except Exception as e:
+                burst.result.set_exception(e)
+                # retrieve it so asyncio doesn't warn when every caller has gone away
+                burst.result.exception()
+        finally:
+            # cancelled (possibly before the burst was even flushed)
+            if self._bursts.get(user_key) is burst:
+                del self._bursts[user_key]
+            if not burst.result.done():
+                burst.result.cancel()
+            if burst.reservation is not None:
+                burst.reservation.release()
+
+    def stats(self):
+        return {
+            "window_seconds": self.window,
+            "max_wait_seconds": self.max_wait,
+            "messages": self._messages,
+            "turns": self._flushes,
+            "turns_saved": self._messages - self._flushes - sum(len(b.requests) for b in self._bursts.values()),
+            "largest_burst": self._largest_burst,
+            "pending_users": len(self._bursts),
+        }
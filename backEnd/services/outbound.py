@@ -0,0 +1,60 @@
+import os
+import httpx
+
+# Where webhook replies go. With OUTBOUND_URL set, replies are POSTed there as
+# {"to": user_identifier, "text": reply}; otherwise they are just printed.
+# For local testing, run a stub receiver with `python -m services.outbound`
+# and set OUTBOUND_URL=http://localhost:8099/send
+OUTBOUND_URL = os.getenv('OUTBOUND_URL')
+OUTBOUND_TOKEN = os.getenv('OUTBOUND_TOKEN')
+OUTBOUND_TIMEOUT = float(os.getenv('OUTBOUND_TIMEOUT', '10'))
+
+
+class LogSender:
+    """Prints replies instead of sending them"""
+
+    async def send(self, user_identifier, text):
+        print(f"📤 reply to {user_identifier}: {text}")
+
+    async def close(self):
+        pass
+
+
+class HttpSender:
+    """POSTs replies to a messaging gateway; raises on non-2xx so the caller can retry"""
+
+    def __init__(self, url, token=None, timeout=OUTBOUND_TIMEOUT):
+        self.url = url
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self._client = httpx.AsyncClient(timeout=timeout, headers=headers)
+
+    async def send(self, user_identifier, text):
+        response = await self._client.post(self.url, json={"to": user_identifier, "text": text})
+        response.raise_for_status()
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def get_outbound_sender():
+    if OUTBOUND_URL:
+        return HttpSender(OUTBOUND_URL, OUTBOUND_TOKEN)
+    return LogSender()
+
+
+if __name__ == "__main__":
+    # stub gateway: prints whatever HttpSender posts to it
+    import json
+    import sys
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            print(f"{self.path}: {json.loads(body or b'{}')}")
+            self.send_response(200)
+            self.end_headers()
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8099
+    print(f"Stub outbound gateway on http://localhost:{port}")
+    HTTPServer(("", port), StubHandler).serve_forever()
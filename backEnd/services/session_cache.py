@@ -0,0 +1,88 @@
+import os
+from utils.ttl_cache import TTLCache
+from services.ai_service import config_registry, create_chat_session, create_chat_session_async
+
+# Live Gemini chat sessions, keyed by chat_id. Keeping the session keeps the
+# function call / function response turns that rebuilding from the messages
+# table loses, and saves rebuilding the history on every message.
+GEMINI_SESSION_CACHE_SIZE = int(os.getenv('GEMINI_SESSION_CACHE_SIZE', '500'))
+GEMINI_SESSION_IDLE_TTL = float(os.getenv('GEMINI_SESSION_IDLE_TTL', '1800'))
+# Memory bound per session: older turns are dropped when a session is refreshed
+GEMINI_SESSION_MAX_TURNS = int(os.getenv('GEMINI_SESSION_MAX_TURNS', '40'))
+
+# (chat_id, "sync" | "async") -> (session, GenerateContentConfig it was built with)
+_sessions = TTLCache(maxsize=GEMINI_SESSION_CACHE_SIZE, ttl=GEMINI_SESSION_IDLE_TTL, sliding=True)
+
+
+def _trim_history(history, max_turns=GEMINI_SESSION_MAX_TURNS):
+    """
+    Keeps roughly the last max_turns contents, starting on a real user message
+    so a function response is never left without its function call.
+    """
+    if len(history) <= max_turns:
+        return history
+    for start in range(len(history) - max_turns, len(history)):
+        content = history[start]
+        if content.role == "user" and any(part.text for part in content.parts or []):
+            return history[start:]
+    return []
+
+
+def _cached(key, config):
+    """Returns the cached session's history if it needs a rebuild, the session if it can be reused."""
+    entry = _sessions.get(key)
+    if entry is None:
+        return None, None
+    session, built_with = entry
+    history = session.get_history(curated=True)
+    if built_with is config and len(history) <= GEMINI_SESSION_MAX_TURNS:
+        return session, None
+    # new config (new day in the system prompt, or the context cache it points
+    # to is about to expire) or too long: rebuild, keeping the tool turns
+    return None, _trim_history(history)
+
+
+def has_chat_session(chat_id, use_async=True):
+    """True if a live session is cached, i.e. the caller can skip loading history"""
+    return _sessions.peek((chat_id, "async" if use_async else "sync")) is not None
+
+
+def get_chat_session(client_start, chat_id, load_history):
+    """
+    Returns the cached session for chat_id, or builds one from load_history()
+    (Gemini style history, e.g. get_chat_history_as_text) on a miss.
+    """
+    key = (chat_id, "sync")
+    config = config_registry.get_config()
+    session, history = _cached(key, config)
+    if session is not None:
+        return session
+    if history is None:
+        history = load_history()
+    session = create_chat_session(client_start, history, config)
+    _sessions.set(key, (session, config))
+    return session
+
+
+async def get_chat_session_async(client_start, chat_id, load_history):
+    """Async get_chat_session: load_history is an async callable, the session uses client.aio"""
+    key = (chat_id, "async")
+    config = await config_registry.get_config_async()
+    session, history = _cached(key, config)
+    if session is not None:
+        return session
+    if history is None:
+        history = await load_history()
+    session = await create_chat_session_async(client_start, history, config)
+    _sessions.set(key, (session, config))
+    return session
+
+
+def drop_chat_session(chat_id):
+    """Forget a chat's session, e.g. after an error left it in an unknown state"""
+    _sessions.pop((chat_id, "sync"))
+    _sessions.pop((chat_id, "async"))
+
+
+def get_session_cache_stats():
+    return _sessions.stats()
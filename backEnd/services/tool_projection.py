@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+
+# Tool results are cut down to what the model needs before they go back to
+# Gemini as a function response. Raw Google resources carry etags, creator,
+# organizer, reminders, links... none of which help answering the user.
+TOOL_RESULT_MAX_ITEMS = int(os.getenv('TOOL_RESULT_MAX_ITEMS', '25'))
+
+_stats_lock = threading.Lock()
+_stats = {}  # tool name -> {"calls", "raw_tokens", "projected_tokens"}
+
+
+def estimate_tokens(data):
+    """Rough token count of a JSON payload (~4 characters per token)"""
+    return len(json.dumps(data, default=str, ensure_ascii=False)) // 4
+
+
+def _when(value):
+    """{'dateTime': ...} / {'date': ...} -> the string itself"""
+    if isinstance(value, dict):
+        return value.get('dateTime') or value.get('date')
+    return value
+
+
+def _event(event):
+    if not isinstance(event, dict) or 'error' in event:
+        return event
+    projected = {
+        'id': event.get('id'),
+        'summary': event.get('summary'),
+        'start': _when(event.get('start')),
+        'end': _when(event.get('end')),
+    }
+    for optional in ('location', 'calendar', 'conflicts'):
+        if event.get(optional):
+            projected[optional] = event[optional]
+    return projected
+
+
+def _calendar(calendar):
+    if not isinstance(calendar, dict) or 'error' in calendar:
+        return calendar
+    return {'id': calendar.get('id'), 'name': calendar.get('name') or calendar.get('summary')}
+
+
+def _truncate(items, key, project, limit=None):
+    """{key: first `limit` projected items} plus counts when something was cut"""
+    limit = TOOL_RESULT_MAX_ITEMS if limit is None else limit
+    items = items or []
+    result = {key: [project(item) for item in items[:limit]]}
+    if len(items) > limit:
+        result[f"{key}_total"] = len(items)
+        result[f"{key}_omitted"] = len(items) - limit
+    return result
+
+
+def _project_event_list(key):
+    def project(data):
+        return _truncate(data.get(key), key, _event) | {k: v for k, v in data.items() if k != key}
+    return project
+
+
+def _project_bulk(data):
+    result = {
+        "created_count": data.get("created_count"),
+        "error_count": data.get("error_count"),
+    }
+    result |= _truncate(
+        data.get("created"), "created",
+        lambda event: {"index": event.get("index"), **_event(event)}
+    )
+    result |= _truncate(data.get("errors"), "errors", lambda error: error)
+    return result
+
+
+def _project_free_slots(data):
+    return _truncate(data.get("free_slots"), "free_slots", lambda slot: slot) | {
+        k: v for k, v in data.items() if k != "free_slots"
+    }
+
+
+PROJECTORS = {
+    'create_calendar': _calendar,
+    'insert_calendar_event': _event,
+    'insert_calendar_events_bulk': _project_bulk,
+    'find_free_slots': _project_free_slots,
+    'list_all_calendar_events': _project_event_list("events"),
+    'list_calendar_events': _project_event_list("my_events"),
+    'list_calendar_list': lambda data: _truncate(data.get("calendars"), "calendars", _calendar),
+}
+
+
+def project_tool_result(name, data):
+    """Compact version of a tool's result for the model; errors pass through untouched"""
+    projector = PROJECTORS.get(name)
+    if projector is None or not isinstance(data, dict) or (set(data) <= {'error', 'available_calendars'}):
+        return data
+
+    projected = projector(data)
+
+    raw_tokens = estimate_tokens(data)
+    projected_tokens = estimate_tokens(projected)
+    with _stats_lock:
+        entry = _stats.setdefault(name, {"calls": 0, "raw_tokens": 0, "projected_tokens": 0})
+        entry["calls"] += 1
+        entry["raw_tokens"] += raw_tokens
+        entry["projected_tokens"] += projected_tokens
+    return projected
+
+
+def get_tool_projection_stats():
+    """Estimated tokens per tool before/after projection"""
+    with _stats_lock:
+        report = {}
+        for name, entry in _stats.items():
+            raw = entry["raw_tokens"]
+            report[name] = dict(
+                entry,
+                saved_tokens=raw - entry["projected_tokens"],
+                saved_ratio=(1 - entry["projected_tokens"] / raw) if raw else 0.0,
+            )
+        return report
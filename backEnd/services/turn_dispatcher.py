@@ -0,0 +1,148 @@
+import asyncio
+import os
+import time
+
+# Turns of the same user run one at a time, in arrival order, so each turn sees
+# the previous one's messages and Gemini session. Different users run in
+# parallel, up to TURN_MAX_CONCURRENCY turns at once.
+TURN_MAX_CONCURRENCY = int(os.getenv('TURN_MAX_CONCURRENCY', '32'))
+# Turns one user may have running + waiting before we answer 429
+TURN_QUEUE_MAX_DEPTH = int(os.getenv('TURN_QUEUE_MAX_DEPTH', '5'))
+
+
+class TurnQueueFull(Exception):
+    """The user already has TURN_QUEUE_MAX_DEPTH turns in flight."""
+
+
+class _Lane:
+    """One user's queue: asyncio.Lock hands itself to waiters in FIFO order."""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class _Turn:
+    """
+    A reserved place in a user's lane. Reserving happens on creation (and raises
+    TurnQueueFull right away); `async with` waits for the user's previous turns
+    and a global slot.
+    """
+
+    def __init__(self, dispatcher, user_key):
+        self._dispatcher = dispatcher
+        self._user_key = user_key
+        self._lane = dispatcher._reserve(user_key)
+        self._holding = False
+        self._released = False
+
+    async def __aenter__(self):
+        queued_at = time.monotonic()
+        try:
+            await self._lane.lock.acquire()
+            try:
+                await self._dispatcher._slots.acquire()
+            except BaseException:
+                self._lane.lock.release()
+                raise
+        except BaseException:
+            self.release()
+            raise
+        self._holding = True
+        self._dispatcher._started(time.monotonic() - queued_at)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._holding:
+            self._dispatcher._slots.release()
+            self._lane.lock.release()
+            self._holding = False
+            self._dispatcher._finished()
+        self.release()
+        return False
+
+    def release(self):
+        """Gives the place back (once). `async with` does this itself; call it for a turn that won't be entered."""
+        if not self._released:
+            self._released = True
+            self._dispatcher._release(self._user_key, self._lane)
+
+
+class TurnDispatcher:
+    """
+    Per-user ordered queues in front of the chat pipeline:
+
+        async with turn_dispatcher.turn(request.user_id):
+            ...
+
+    Lanes exist only while a user has turns in flight. Everything runs on the
+    server's event loop, so no locking is needed around the lane table.
+    """
+
+    def __init__(self, max_concurrency=TURN_MAX_CONCURRENCY, max_depth=TURN_QUEUE_MAX_DEPTH):
+        self.max_concurrency = max_concurrency
+        self.max_depth = max_depth
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._lanes = {}
+
+        # stats
+        self._running = 0
+        self._peak_running = 0
+        self._started_count = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._peak_depth = 0
+
+    def is_full(self, user_key):
+        lane = self._lanes.get(user_key)
+        return lane is not None and lane.depth >= self.max_depth
+
+    def turn(self, user_key):
+        """Reserves a place for one turn; raises TurnQueueFull if the user's lane is full"""
+        return _Turn(self, user_key)
+
+    def _reserve(self, user_key):
+        lane = self._lanes.get(user_key)
+        if lane is None:
+            lane = self._lanes[user_key] = _Lane()
+        if lane.depth >= self.max_depth:
+            self._rejected += 1
+            raise TurnQueueFull(f"Too many messages in progress for {user_key}, try again in a moment")
+        lane.depth += 1
+        self._peak_depth = max(self._peak_depth, lane.depth)
+        return lane
+
+    def _release(self, user_key, lane):
+        lane.depth -= 1
+        if lane.depth == 0 and self._lanes.get(user_key) is lane:
+            del self._lanes[user_key]
+
+    def _started(self, wait):
+        self._running += 1
+        self._peak_running = max(self._peak_running, self._running)
+        self._started_count += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+    def _finished(self):
+        self._running -= 1
+
+    def stats(self):
+        queued = sum(lane.depth for lane in self._lanes.values()) - self._running
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_depth": self.max_depth,
+            "running": self._running,
+            "peak_running": self._peak_running,
+            "queued": queued,
+            "users_in_flight": len(self._lanes),
+            "peak_user_depth": self._peak_depth,
+            "turns": self._started_count,
+            "rejected": self._rejected,
+            "avg_wait_ms": (self._total_wait / self._started_count * 1000) if self._started_count else 0.0,
+            "max_wait_ms": self._max_wait * 1000,
+        }
+
+
+turn_dispatcher = TurnDispatcher()
@@ -1,14 +1,36 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List
-from .main_logic import AiServerRunning
+from .main_logic import AiServerRunningAsync, AiServerRunningStream, TURN_FAILED_REPLY
 import os
+import asyncio
 from google_auth_oauthlib.flow import Flow
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, StreamingResponse
 import json
 from database.get_from_data import get_or_create_app_user
 from database.save_new_data import insert_message, save_user_google_creds
+from database.connection import get_pool_stats, close_pool
+from database.async_connection import get_async_pool_stats, close_async_pool
+from database.id_cache import get_id_cache_stats
+from database.create_new_data import create_history
+from database.partitions import run_partition_maintenance
+from database.message_writer import get_message_writer_stats, close_message_writer
+from services.session_cache import get_session_cache_stats
+from services.ai_service import config_registry
+from services.tool_projection import get_tool_projection_stats
+from services.turn_dispatcher import turn_dispatcher, TurnQueueFull
+from services.message_coalescer import MessageCoalescer
+from services.inbound_worker import InboundWorkerPool
+from database.inbound_messages import insert_inbound_async, get_inbound_response_async, finish_inbound_async
+from services.idempotency import cached_response, remember_response, get_idempotency_stats
+from services.intent_router import get_intent_router_stats
+import hashlib
+import hmac
+from services.calendar_cache import get_calendar_cache_stats
+from services.calendar_sync import get_calendar_sync_stats
+from utils.api_auth import load_discovery_doc, get_service_cache_stats
+from utils.credential_manager import credential_manager
 
 # from database import get_db, init_db, UserCRUD, ConversationCRUD, User
 SRC_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,6 +40,8 @@ print(f"📂 Looking for secrets file at: {CLIENT_SECRETS_FILE}")
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Shared secret of the messaging provider; /webhook bodies must be signed with it
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
 app = FastAPI()
 
 app.add_middleware(
@@ -33,12 +57,16 @@ class ChatRequest(BaseModel):
     Example:
     {
         "user_id": "972501234567",
-        "message": "Create a calendar called Work"
+        "message": "Create a calendar called Work",
+        "message_id": "wamid.HBgM..."
     }
     """
     user_id: str      
     message: str     
     session_id: Optional[str] = None 
+    # provider's id for the message; a redelivery with the same id is answered
+    # from the first delivery instead of running again
+    message_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     """
@@ -56,6 +84,33 @@ class ChatResponse(BaseModel):
     response: str
     function_called: Optional[str] = None
     success: bool = True
+    # True when this message was answered together with a later one
+    # (MESSAGE_COALESCE_WINDOW); response is empty and nothing should be sent
+    coalesced: bool = False
+    # True when message_id was seen before; response is the earlier answer
+    # (empty if that one is still being processed)
+    duplicate: bool = False
+
+@app.on_event("startup")
+def startup():
+    # applies any pending schema migrations, then makes sure next months' partitions exist
+    create_history()
+    run_partition_maintenance(archive=False)
+    load_discovery_doc('calendar', 'v3')
+    # refresh Google tokens before they expire, off the request path
+    credential_manager.start()
+
+@app.on_event("startup")
+async def start_inbound_workers():
+    await inbound_workers.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await inbound_workers.stop()
+    credential_manager.stop()
+    close_message_writer()
+    await close_async_pool()
+    close_pool()
 
 @app.get('/')
 def root():
@@ -65,27 +120,174 @@ def root():
 async def getMessage(user_id: str,message: str,session_id: Optional[str]):
     return {'all_messages':'niga'}
 
+async def _run_turn(requests, turn=None):
+    """
+    One turn for a user's message(s), in order with their other turns.
+    turn: a place already reserved with turn_dispatcher.turn (the coalescer
+    reserves it when the burst starts, so TurnQueueFull never hits a burst).
+    """
+    first, *followups = requests
+    if turn is None:
+        turn = turn_dispatcher.turn(first.user_id)
+    async with turn:
+        return await AiServerRunningAsync(first, followups=[r.message for r in followups])
+
+# folds a user's rapid-fire messages into one turn (off unless MESSAGE_COALESCE_WINDOW is set)
+message_coalescer = MessageCoalescer(_run_turn, reserve=turn_dispatcher.turn)
+
 @app.post('/chat',response_model=ChatResponse)
 async def chat(request: ChatRequest):
-    try:
-        response_text, function_info = AiServerRunning(request)
-        return ChatResponse(
-            user_id=request.user_id,
-            response=response_text,
-            function_called=function_info.get('name') if function_info else None,
-            success=True
+    cached = cached_response(request.user_id, request.message_id)
+    if cached is not None:
+        return ChatResponse(user_id=request.user_id, response=cached, duplicate=True)
+
+    inbound_id = None
+    if request.message_id:
+        inbound_id = await insert_inbound_async(
+            request.user_id, request.message, request.message_id, channel='chat', status='processing'
         )
-    
-    except Exception as e:
+        if inbound_id is None:
+            earlier = await get_inbound_response_async(request.user_id, request.message_id)
+            return ChatResponse(
+                user_id=request.user_id,
+                response=(earlier[1] if earlier else None) or "",
+                duplicate=True
+            )
+
+    try:
+        response = await _chat_response(request)
+    except BaseException as e:
+        # 429, but also a client disconnect (CancelledError): release the claim
+        # so a redelivery can run, 'chat' rows are never recovered
+        if inbound_id is not None:
+            error = e.detail if isinstance(e, HTTPException) else repr(e)
+            await asyncio.shield(finish_inbound_async(inbound_id, 'failed', last_error=str(error)))
+        raise
+
+    if inbound_id is not None:
+        await finish_inbound_async(inbound_id, 'done' if response.success else 'failed', response=response.response)
+        if response.success:
+            remember_response(request.user_id, request.message_id, response.response)
+    return response
+
+async def _chat_response(request):
+    try:
+        if message_coalescer.enabled:
+            (response_text, function_info), answered = await message_coalescer.submit(request.user_id, request)
+        else:
+            (response_text, function_info), answered = await _run_turn([request]), True
+    except TurnQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception:
+        # logged by AiServerRunningAsync; the row is marked failed and nothing is cached
         return ChatResponse(
             user_id=request.user_id,
-            response=f"Error processing request: {str(e)}",
+            response=TURN_FAILED_REPLY,
             function_called=None,
             success=False
         )
 
+    if not answered:
+        return ChatResponse(user_id=request.user_id, response="", coalesced=True)
+    return ChatResponse(
+        user_id=request.user_id,
+        response=response_text,
+        function_called=function_info.get('name') if function_info else None,
+        success=True
+    )
 
 
+
+async def _webhook_turn(request):
+    """
+    Runs a webhook message like /chat does; returns the reply to send, if any.
+    A failed turn raises, so the worker pool marks the message failed.
+    """
+    if message_coalescer.enabled:
+        (response_text, _), answered = await message_coalescer.submit(request.user_id, request)
+        return response_text if answered else None
+    response_text, _ = await _run_turn([request])
+    return response_text
+
+inbound_workers = InboundWorkerPool(
+    _webhook_turn,
+    make_request=lambda user_identifier, text: ChatRequest(user_id=user_identifier, message=text),
+    on_done=lambda request, reply: remember_response(request.user_id, request.message_id, reply)
+)
+
+def _valid_signature(body, signature):
+    """X-Hub-Signature-256: sha256=<hex HMAC of the raw body with WEBHOOK_SECRET>"""
+    if not WEBHOOK_SECRET:
+        return True
+    expected = "sha256=" + hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
+
+@app.post('/webhook')
+async def webhook(request: Request):
+    """
+    Inbound messages from the messaging provider. The message is validated and
+    stored, then answered right away; the turn runs on the inbound workers and
+    the reply goes out through the outbound sender.
+    Body: {"user_id": "...", "message": "...", "message_id": "..."}
+    """
+    body = await request.body()
+    if not _valid_signature(body, request.headers.get('X-Hub-Signature-256')):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    try:
+        chat_request = ChatRequest.model_validate_json(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid payload: {e}")
+
+    if cached_response(chat_request.user_id, chat_request.message_id) is not None:
+        return {"status": "duplicate"}
+    inbound_id = await insert_inbound_async(
+        chat_request.user_id, chat_request.message, chat_request.message_id,
+        claimed_by=inbound_workers.owner, lease_seconds=inbound_workers.lease_seconds
+    )
+    if inbound_id is None:
+        # redelivery of a message we already accepted
+        return {"status": "duplicate"}
+    inbound_workers.submit(inbound_id, chat_request)
+    return {"status": "accepted", "id": inbound_id}
+
+def _sse(event, data):
+    """One Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@app.post('/chat/stream')
+async def chat_stream(request: ChatRequest):
+    """
+    Same as POST /chat but streams the reply as Server-Sent Events:
+    "text" (reply pieces), "tool_call"/"tool_result" (calendar progress),
+    then "done" with the full text, or "error".
+    """
+    if turn_dispatcher.is_full(request.user_id):
+        raise HTTPException(status_code=429, detail="Too many messages in progress, try again in a moment")
+
+    async def events():
+        try:
+            turn = turn_dispatcher.turn(request.user_id)
+        except TurnQueueFull as e:
+            yield _sse("error", {"text": str(e)})
+            return
+        async with turn:
+            async for event, data in AiServerRunningStream(request):
+                if event == "done":
+                    function_info = data.get("function_info")
+                    data = {
+                        "user_id": request.user_id,
+                        "response": data["text"],
+                        "function_called": function_info.get('name') if function_info else None,
+                        "success": True,
+                    }
+                yield _sse(event, data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get('/niga')
 def yotam(text):
     return {'text':{text}}
@@ -95,6 +297,28 @@ def health_check():
     """Simple health check endpoint for the frontend"""
     return {"status": "ok"}
 
+@app.get("/metrics")
+def metrics():
+    """Runtime numbers used for capacity tuning"""
+    return {
+        "db_pool": get_pool_stats(),
+        "db_async_pool": get_async_pool_stats(),
+        "id_cache": get_id_cache_stats(),
+        "message_writer": get_message_writer_stats(),
+        "gemini_sessions": get_session_cache_stats(),
+        "gemini_configs": config_registry.stats(),
+        "calendar_cache": get_calendar_cache_stats(),
+        "calendar_sync": get_calendar_sync_stats(),
+        "google_services": get_service_cache_stats(),
+        "google_credentials": credential_manager.stats(),
+        "tool_results": get_tool_projection_stats(),
+        "turn_dispatcher": turn_dispatcher.stats(),
+        "message_coalescer": message_coalescer.stats(),
+        "inbound_workers": inbound_workers.stats(),
+        "idempotency_cache": get_idempotency_stats(),
+        "intent_router": get_intent_router_stats(),
+    }
+
 
 @app.get("/auth/login")
 async def login(user_id: str):
@@ -118,7 +342,9 @@ async def login(user_id: str):
     return RedirectResponse(authorization_url)
 
 @app.get("/auth/callback")
-async def auth_callback(code: str, state: str):
+def auth_callback(code: str, state: str):
+    # plain def: FastAPI runs it in the threadpool, so the blocking token exchange
+    # and DB writes don't stall the event loop
     try:
         client_identifier = state 
         
@@ -143,6 +369,7 @@ async def auth_callback(code: str, state: str):
             token_expiry=creds.expiry.isoformat(),
             scopes=json.dumps(creds.scopes) if creds.scopes else None
         )
+        credential_manager.forget(internal_user_id)
 
         return {"message": "Login successful! Tokens saved to Database."}
 
@@ -1,38 +1,66 @@
 from datetime import datetime
-from services.ai_service import create_chat_session, send_message
+from services.ai_service import send_message, send_message_async, send_message_stream
+from services.session_cache import get_chat_session, get_chat_session_async, has_chat_session, drop_chat_session
 # Note: You need to update your database import functions to match the new schema
-from database.get_from_data import get_or_create_app_user, get_user_google_creds, get_or_create_chat, get_chat_history_as_text
-from database.save_new_data import insert_message
+from database.get_from_data import begin_turn, get_chat_history_as_text
+from database.async_data import begin_turn_async, get_chat_history_async, insert_message_async
+from database.id_cache import peek_chat_id
+from database.message_writer import store_message, store_message_async
 from model.gemini_auth import client
+from utils.credential_manager import credential_manager
+from services.intent_router import route_message
+import asyncio
+
+CHAT_NAME = "WhatsApp_General"
+# What the user sees when a turn fails; the exception itself only goes to the log
+TURN_FAILED_REPLY = "Sorry, something went wrong processing your request. Please try again."
+HISTORY_LIMIT = 10
+
+def _history_limit(user_identifier, use_async):
+    """No need to load history from the DB when the chat already has a live Gemini session"""
+    chat_id = peek_chat_id(user_identifier, CHAT_NAME)
+    if chat_id is not None and has_chat_session(chat_id, use_async=use_async):
+        return 0
+    return HISTORY_LIMIT
 
 def AiServerRunning(request):
     """
     Main controller logic.
     request: ChatRequest object containing user_id (string) and message (string)
     """
+    chat_id = None
     try:
-        client_identifier = request.user_id 
-        internal_user_id = get_or_create_app_user(client_identifier)
-        chat_id = get_or_create_chat(internal_user_id, chat_name="WhatsApp_General")
-        insert_message(
-            text=request.message, 
-            is_from_bot=False, 
-            user_id=internal_user_id, 
-            chat_id=chat_id
+        history_limit = _history_limit(request.user_id, use_async=False)
+        turn = begin_turn(
+            request.user_id,
+            request.message,
+            chat_name=CHAT_NAME,
+            history_limit=history_limit
         )
+        internal_user_id = turn['user_id']
+        chat_id = turn['chat_id']
         # this is the google cred i need to chek if it is exist in whattsap
-        access_token,refresh_token,scopes = get_user_google_creds(internal_user_id)        
-
-        history_context = get_chat_history_as_text(chat_id, limit=10)
-
-        gemini_session = create_chat_session(client, history_context) 
-        
-        
-        response_text, function_info = send_message(gemini_session, request.message, internal_user_id)
-        insert_message(
-            text=response_text, 
-            is_from_bot=True, 
-            user_id=internal_user_id, 
+        # (handing it to the credential manager saves the tools a DB query)
+        credential_manager.prime(internal_user_id, turn['creds'])
+
+        def load_history():
+            if history_limit:
+                return turn['history']
+            # the session got evicted since we checked
+            return get_chat_history_as_text(chat_id, limit=HISTORY_LIMIT, exclude_message_id=turn['message_id'])
+
+        routed = route_message(internal_user_id, request.message)
+        if routed:
+            # the cached session didn't see this exchange, the next turn reloads it from the DB
+            drop_chat_session(chat_id)
+            response_text, function_info = routed
+        else:
+            gemini_session = get_chat_session(client, chat_id, load_history)
+            response_text, function_info = send_message(gemini_session, request.message, internal_user_id)
+        store_message(
+            text=response_text,
+            is_from_bot=True,
+            user_id=internal_user_id,
             chat_id=chat_id
         )
 
@@ -40,7 +68,146 @@ def AiServerRunning(request):
 
 
     except Exception as e:
+        if chat_id is not None:
+            drop_chat_session(chat_id)
         import traceback
         traceback.print_exc()  # This prints full details to your terminal
         # RETURN THE ACTUAL ERROR TO THE CHAT SO YOU CAN SEE IT
-        return f"🛑 DEBUG ERROR: {str(e)}", None
\ No newline at end of file
+        return f"🛑 DEBUG ERROR: {str(e)}", None
+
+
+async def _begin_turn_async(request):
+    """Saves the inbound message and returns (internal_user_id, chat_id, load_history)"""
+    history_limit = _history_limit(request.user_id, use_async=True)
+    turn = await begin_turn_async(
+        request.user_id,
+        request.message,
+        chat_name=CHAT_NAME,
+        history_limit=history_limit
+    )
+    internal_user_id = turn['user_id']
+    chat_id = turn['chat_id']
+    credential_manager.prime(internal_user_id, turn['creds'])
+
+    async def load_history():
+        if history_limit:
+            return turn['history']
+        return await get_chat_history_async(chat_id, limit=HISTORY_LIMIT, exclude_message_id=turn['message_id'])
+
+    return internal_user_id, chat_id, load_history
+
+
+async def _store_followups(followups, internal_user_id, chat_id):
+    """Coalesced follow-up messages, each as its own row"""
+    for text in followups:
+        await insert_message_async(text, False, internal_user_id, chat_id)
+
+
+async def _route_async(internal_user_id, chat_id, user_message):
+    """
+    Intent router fast path: (reply, function_info) when the message was
+    answered without Gemini, else None
+    """
+    loop = asyncio.get_running_loop()
+    routed = await loop.run_in_executor(None, route_message, internal_user_id, user_message)
+    if routed:
+        # the cached session didn't see this exchange, the next turn reloads it from the DB
+        drop_chat_session(chat_id)
+    return routed
+
+
+async def AiServerRunningAsync(request, followups=()):
+    """
+    Async version of AiServerRunning used by the API.
+    DB, Gemini and calendar tool calls never block the event loop;
+    AiServerRunning stays around for scripts.
+    followups: texts of later messages coalesced into this turn; they are
+    stored separately and answered together with request.message.
+    Raises if the turn failed: nothing is stored as the bot's reply and the
+    cached session is dropped, the caller decides what the user sees.
+    """
+    chat_id = None
+    pending_followups = list(followups)
+    try:
+        internal_user_id, chat_id, load_history = await _begin_turn_async(request)
+        user_message = "\n".join([request.message, *followups])
+
+        routed = await _route_async(internal_user_id, chat_id, user_message)
+        if routed:
+            pending_followups = []
+            await _store_followups(followups, internal_user_id, chat_id)
+            response_text, function_info = routed
+        else:
+            gemini_session = await get_chat_session_async(client, chat_id, load_history)
+            # after the history is loaded, so they only reach the model as part of this turn
+            pending_followups = []
+            await _store_followups(followups, internal_user_id, chat_id)
+            response_text, function_info = await send_message_async(gemini_session, user_message, internal_user_id)
+        await store_message_async(
+            text=response_text,
+            is_from_bot=True,
+            user_id=internal_user_id,
+            chat_id=chat_id
+        )
+
+        return response_text, function_info
+
+    except Exception as e:
+        if chat_id is not None:
+            drop_chat_session(chat_id)
+            if pending_followups:
+                # the turn failed before they were stored; keep them in the chat anyway
+                try:
+                    await _store_followups(pending_followups, internal_user_id, chat_id)
+                except Exception as store_error:
+                    print(f"Error storing coalesced messages: {store_error}")
+        import traceback
+        traceback.print_exc()
+        raise
+
+
+async def AiServerRunningStream(request):
+    """
+    Streaming AiServerRunningAsync: async generator of (event, data) pairs from
+    send_message_stream. The full reply is saved once the stream completes;
+    after an "error" event nothing is saved and the session is dropped.
+    """
+    chat_id = None
+    completed = False
+    try:
+        internal_user_id, chat_id, load_history = await _begin_turn_async(request)
+
+        routed = await _route_async(internal_user_id, chat_id, request.message)
+        if routed:
+            response_text, function_info = routed
+            await store_message_async(
+                text=response_text,
+                is_from_bot=True,
+                user_id=internal_user_id,
+                chat_id=chat_id
+            )
+            completed = True
+            yield "text", response_text
+            yield "done", {"text": response_text, "function_info": function_info}
+            return
+
+        gemini_session = await get_chat_session_async(client, chat_id, load_history)
+        async for event, data in send_message_stream(gemini_session, request.message, internal_user_id):
+            if event == "done":
+                await store_message_async(
+                    text=data["text"],
+                    is_from_bot=True,
+                    user_id=internal_user_id,
+                    chat_id=chat_id
+                )
+                completed = True
+            yield event, data
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        yield "error", {"text": TURN_FAILED_REPLY}
+    finally:
+        # a stream cut short (error or client gone) leaves the session's history unreliable
+        if not completed and chat_id is not None:
+            drop_chat_session(chat_id)
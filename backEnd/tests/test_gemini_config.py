@@ -0,0 +1,120 @@
+"""
+ConfigRegistry against a fake Gemini client (run from backEnd/: python -m pytest tests).
+"""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from services.gemini_config import ConfigRegistry
+
+
+class FakeCaches:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+
+    def create(self, model, config):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("cached content is too small")
+        return SimpleNamespace(name=f"cachedContents/{self.calls}")
+
+
+class FakeAsyncCaches(FakeCaches):
+    async def create(self, model, config):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("cached content is too small")
+        return SimpleNamespace(name=f"cachedContents/aio-{self.calls}")
+
+
+class FakeClient:
+    def __init__(self, delay=0.0, fail=False):
+        self.caches = FakeCaches(delay, fail)
+        self.aio = SimpleNamespace(caches=FakeAsyncCaches(delay, fail))
+
+
+def test_config_is_built_once_per_key():
+    registry = ConfigRegistry(FakeClient(), use_context_cache=False)
+    first = registry.get_config("2026-10-18", "UTC")
+    assert registry.get_config("2026-10-18", "UTC") is first
+    assert registry.get_config("2026-10-19", "UTC") is not first
+    assert registry.stats()["builds"] == 2
+    assert registry.stats()["configs"] == 1
+
+
+def test_context_cache_is_referenced_by_name():
+    client = FakeClient()
+    registry = ConfigRegistry(client, use_context_cache=True)
+    config = registry.get_config("2026-10-18", "UTC")
+    assert config.cached_content == "cachedContents/1"
+    assert config.system_instruction is None
+
+
+def test_context_cache_failure_falls_back_inline():
+    registry = ConfigRegistry(FakeClient(fail=True), use_context_cache=True)
+    config = registry.get_config("2026-10-18", "UTC")
+    assert config.cached_content is None
+    assert "2026-10-18" in config.system_instruction
+    assert registry.stats()["context_cache_failures"] == 1
+
+
+def test_concurrent_callers_share_one_cache_create():
+    client = FakeClient(delay=0.2)
+    registry = ConfigRegistry(client, use_context_cache=True)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get_config("2026-10-18", "UTC")))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    # the registry lock is not held during the network call
+    started = time.monotonic()
+    registry.stats()
+    registry.get_tool()
+    assert time.monotonic() - started < 0.1
+    for thread in threads:
+        thread.join()
+    assert client.caches.calls == 1
+    assert all(config is results[0] for config in results)
+
+
+def test_expired_context_cache_gives_a_new_config():
+    client = FakeClient()
+    # ttl under the one minute safety margin: expires immediately
+    registry = ConfigRegistry(client, use_context_cache=True, context_cache_ttl=30)
+    first = registry.get_config("2026-10-18", "UTC")
+    second = registry.get_config("2026-10-18", "UTC")
+    assert second is not first
+    assert second.cached_content != first.cached_content
+    assert client.caches.calls == 2
+
+
+def test_async_path_uses_aio_client_and_single_flight():
+    client = FakeClient(delay=0.1)
+    registry = ConfigRegistry(client, use_context_cache=True)
+
+    async def run():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        tick_task = asyncio.create_task(ticker())
+        configs = await asyncio.gather(*(registry.get_config_async("2026-10-18", "UTC") for _ in range(5)))
+        tick_task.cancel()
+        return configs, ticks
+
+    configs, ticks = asyncio.run(run())
+    assert client.caches.calls == 0
+    assert client.aio.caches.calls == 1
+    assert all(config is configs[0] for config in configs)
+    assert configs[0].cached_content == "cachedContents/aio-1"
+    # the loop kept running while the cache was created
+    assert ticks > 3
@@ -0,0 +1,137 @@
+"""
+InboundWorkerPool with a fake handler and inbound_messages calls stubbed out,
+and HttpSender against a local HTTP server (run from backEnd/: python -m pytest tests).
+"""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+import services.inbound_worker as inbound_worker
+from services.inbound_worker import InboundWorkerPool
+from services.outbound import HttpSender
+
+
+class RecordingSender:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, user_identifier, text):
+        self.sent.append((user_identifier, text))
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def no_db(monkeypatch):
+    finished = {}
+
+    async def mark(inbound_id, lease_seconds=0):
+        return 1
+
+    async def finish(inbound_id, status, response=None, last_error=None):
+        finished[inbound_id] = status
+
+    monkeypatch.setattr(inbound_worker, "mark_inbound_processing_async", mark)
+    monkeypatch.setattr(inbound_worker, "finish_inbound_async", finish)
+    return finished
+
+
+def request(user_id, message):
+    return SimpleNamespace(user_id=user_id, message=message, message_id=None)
+
+
+def test_one_busy_user_holds_one_worker(no_db):
+    started = []
+
+    async def handler(req):
+        started.append(req.message)
+        await asyncio.sleep(0.05 if req.user_id == "busy" else 0.01)
+        return f"re: {req.message}"
+
+    async def run():
+        pool = InboundWorkerPool(handler, request, workers=2, sender_factory=RecordingSender)
+        await pool.start(recover=False)
+        # a user's later messages may run together (coalescing), but only on one worker
+        for n in range(6):
+            pool.submit(n, request("busy", f"busy {n}"))
+        pool.submit(100, request("other", "hello"))
+        await asyncio.wait_for(pool._queue.join(), 2)
+        stats = pool.stats()
+        sent = list(pool.sender.sent)
+        await pool.stop()
+        return stats, sent
+
+    stats, sent = asyncio.run(run())
+    # "other" was not stuck behind all of busy's turns
+    assert started.index("hello") < started.index("busy 5")
+    assert [text for user, text in sent if user == "busy"] == [f"re: busy {n}" for n in range(6)]
+    assert stats["deferred"] >= 4
+    assert stats["done"] == 7
+    assert set(no_db.values()) == {"done"}
+
+
+class Gateway(BaseHTTPRequestHandler):
+    """Fails the first `failures` posts with a 503, then accepts"""
+    failures = 0
+    received = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        Gateway.received.append((self.headers.get("Authorization"), body))
+        if Gateway.failures > 0:
+            Gateway.failures -= 1
+            self.send_response(503)
+        else:
+            self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gateway():
+    server = HTTPServer(("127.0.0.1", 0), Gateway)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    Gateway.received = []
+    yield f"http://127.0.0.1:{server.server_address[1]}/send"
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_sender_posts_reply_and_retries(no_db, gateway):
+    Gateway.failures = 2
+
+    async def run():
+        pool = InboundWorkerPool(lambda req: None, request, max_attempts=3, retry_delay=0.01,
+                                 sender_factory=lambda: HttpSender(gateway, token="secret"))
+        pool.sender = pool._sender_factory()
+        error = await pool._send("+972500000000", "hi")
+        await pool.sender.close()
+        return error, pool.stats()
+
+    error, stats = asyncio.run(run())
+    assert error is None
+    assert stats["send_failures"] == 2
+    assert Gateway.received[-1] == ("Bearer secret", {"to": "+972500000000", "text": "hi"})
+
+
+def test_http_sender_gives_up_after_max_attempts(no_db, gateway):
+    Gateway.failures = 5
+
+    async def run():
+        pool = InboundWorkerPool(lambda req: None, request, max_attempts=3, retry_delay=0.01,
+                                 sender_factory=lambda: HttpSender(gateway))
+        pool.sender = pool._sender_factory()
+        error = await pool._send("+972500000000", "hi")
+        await pool.sender.close()
+        return error
+
+    assert "503" in asyncio.run(run())
+    assert len(Gateway.received) == 3
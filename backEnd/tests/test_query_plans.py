@@ -0,0 +1,26 @@
+"""
+EXPLAINs the hot path queries (the SQL the app ships, see HOT_PATH_QUERIES)
+against the database in DB_HOST / DB_NAME / ...; skipped when there is none.
+Migrations are applied first, like on API startup.
+"""
+import os
+
+import pytest
+
+from database.migrations import HOT_PATH_QUERIES, check_query_plans, run_migrations
+
+
+@pytest.fixture(scope="module")
+def plan_problems():
+    if not os.getenv('DB_NAME'):
+        pytest.skip("no database configured (DB_NAME)")
+    try:
+        run_migrations()
+    except Exception as e:
+        pytest.skip(f"database not reachable: {e}")
+    return check_query_plans()
+
+
+@pytest.mark.parametrize("name", list(HOT_PATH_QUERIES))
+def test_hot_path_query_uses_an_index(plan_problems, name):
+    assert plan_problems[name] == []
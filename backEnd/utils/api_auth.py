@@ -1,15 +1,81 @@
 import os
-from database.get_from_data import get_user_google_creds
-from database.validation_data import is_token_valid
+import json
+import threading
+import httplib2
+import google_auth_httplib2
 from datetime import datetime
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+from utils.ttl_cache import TTLCache
+from utils.credential_manager import credential_manager
+
+GOOGLE_HTTP_TIMEOUT = float(os.getenv('GOOGLE_HTTP_TIMEOUT', '30'))
+GOOGLE_SERVICE_CACHE_SIZE = int(os.getenv('GOOGLE_SERVICE_CACHE_SIZE', '1000'))
+
+# (api, version) -> parsed discovery document, loaded once per process
+_discovery_docs = {}
+_discovery_lock = threading.Lock()
+# (user_id, api, version) -> (access token the service was built with, service)
+_service_cache = TTLCache(maxsize=GOOGLE_SERVICE_CACHE_SIZE, ttl=None)
+# httplib2.Http is not thread safe, so every thread keeps its own keep-alive connection
+_thread_local = threading.local()
+
+
+def load_discovery_doc(service_name='calendar', service_version='v3'):
+    """
+    The discovery document shipped with googleapiclient, parsed once.
+    Call at startup so the first request doesn't pay for it.
+    """
+    key = (service_name, service_version)
+    doc = _discovery_docs.get(key)
+    if doc is None:
+        with _discovery_lock:
+            doc = _discovery_docs.get(key)
+            if doc is None:
+                raw = get_static_doc(service_name, service_version)
+                if raw is None:
+                    raise ValueError(f"No static discovery document for {service_name} {service_version}")
+                doc = json.loads(raw)
+                _discovery_docs[key] = doc
+    return doc
+
+
+def _thread_http():
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        http = httplib2.Http(timeout=GOOGLE_HTTP_TIMEOUT)
+        _thread_local.http = http
+    return http
+
+
+def _request_builder(creds):
+    """Each request goes out on the calling thread's keep-alive connection, authorized with creds"""
+    def build_request(http, *args, **kwargs):
+        return HttpRequest(google_auth_httplib2.AuthorizedHttp(creds, http=_thread_http()), *args, **kwargs)
+    return build_request
+
+
+def _build_service(creds, service_name, service_version):
+    return build_from_document(
+        load_discovery_doc(service_name, service_version),
+        http=google_auth_httplib2.AuthorizedHttp(creds, http=_thread_http()),
+        requestBuilder=_request_builder(creds),
+    )
+
+
+def invalidate_google_service(user_id, service_name='calendar', service_version='v3'):
+    _service_cache.pop((user_id, service_name, service_version))
+
+
+def get_service_cache_stats():
+    return _service_cache.stats()
 
 def refresh_user_token(user_id, service_name):
     """
-    Refreshes an expired Google OAuth token using the refresh token.
+    Refreshes an expired Google OAuth token using the refresh token
+    and saves it back to user_credentials.
     
     Parameters:
     - user_id (int): The ID of the user.
@@ -18,81 +84,26 @@ def refresh_user_token(user_id, service_name):
     Returns:
     - Credentials object: The newly refreshed Credentials object, or None on failure.
     """
-    db_service_name = f'google_{service_name}'
-    
-    # 1. Retrieve the stored credentials including the refresh token
-    creds_data = get_user_google_creds(user_id, db_service_name)
-    
-    if not creds_data or not creds_data.get('refresh_token'):
-        print(f"No refresh token found for user {user_id} and service {db_service_name}.")
-        return None
-
-    try:
-        # 2. Create a Credentials object from the stored data
-        creds = Credentials(
-            token=creds_data['access_token'],
-            refresh_token=creds_data['refresh_token'],
-            token_uri='https://oauth2.googleapis.com/token',
-            scopes=creds_data['scopes']
-        )
-        
-        # Force the refresh flow by setting expired=True
-        creds.expired = True 
-        
-        # 3. Perform the token refresh using a Request object
-        creds.refresh(Request())
-        
-        # 4. Save the new access token and expiry time back to the database
-        # creds.expiry is a datetime object, converting to ISO format for database TIMESTAMP storage.
-        token_expiry_str = creds.expiry.isoformat()
-        
-        success = get_user_google_creds(
-            user_id=user_id,
-            service_name=db_service_name,
-            access_token=creds.token,
-            # Refresh token may or may not be returned on refresh, so we reuse the original one
-            refresh_token=creds.refresh_token, 
-            token_expiry=token_expiry_str,
-            scopes=creds.scopes
-        )
-        
-        if success:
-            print(f"Token for user {user_id} and service {db_service_name} refreshed and saved successfully.")
-            return creds
-        else:
-            print(f"Failed to save refreshed token for user {user_id} and service {db_service_name}.")
-            return None
-            
-    except Exception as e:
-        print(f"Error refreshing token for user {user_id}: {e}")
-        return None
+    return credential_manager.refresh(user_id, f'google_{service_name}')
 
 
 
 def create_google_calendar_service(user_id, service_name='calendar', service_version='v3',scopes=None):
 
-    # 1. Fetch stored credentials
-    creds_data = get_user_google_creds(user_id)
-    if not creds_data:
+    # 1. Credentials from the credential manager (in memory; kept fresh in the background)
+    creds = credential_manager.get_credentials(user_id, f'google_{service_name}')
+    if not creds:
         return None
 
-    # 2. Refresh token if needed
-    if not is_token_valid(user_id, f'google_{service_name}'):
-        creds = refresh_user_token(user_id, service_name)
-        if not creds:
-            return None
-    else:
-        # 3. Build credentials object
-        creds = Credentials(
-            token=creds_data["access_token"],
-            refresh_token=creds_data["refresh_token"],
-            token_uri="https://oauth2.googleapis.com/token",
-            scopes=creds_data["scopes"]
-        )
-
-    # 4. Build and return calendar service
+    # 2. Reuse this user's service object unless the token rotated
+    cache_key = (user_id, service_name, service_version)
+    cached = _service_cache.get(cache_key)
+    if cached is not None and cached[0] == creds.token:
+        return cached[1]
+
     try:
-        service = build(service_name, service_version, credentials=creds)
+        service = _build_service(creds, service_name, service_version)
+        _service_cache.set(cache_key, (creds.token, service))
         return service
     except Exception as e:
         print(f"Error creating Google Calendar service: {e}")
@@ -0,0 +1,253 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
+from database.get_from_data import get_user_google_creds, get_expiring_credentials
+from database.save_new_data import save_user_google_creds
+from utils.ttl_cache import TTLCache
+from utils.keyed_lock import KeyedLock
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_SECRETS_FILE = os.path.join(os.path.dirname(UTILS_DIR), 'client-secret.json')
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+
+CREDENTIAL_CACHE_SIZE = int(os.getenv('CREDENTIAL_CACHE_SIZE', '10000'))
+CREDENTIAL_CACHE_TTL = float(os.getenv('CREDENTIAL_CACHE_TTL', '3600'))
+# The background job refreshes tokens that expire within this window...
+TOKEN_REFRESH_AHEAD = int(os.getenv('TOKEN_REFRESH_AHEAD_SECONDS', '600'))
+# ...and wakes up this often
+TOKEN_REFRESH_INTERVAL = float(os.getenv('TOKEN_REFRESH_INTERVAL_SECONDS', '60'))
+# ...but only for users this process served within the last this many seconds;
+# everyone else refreshes inline on their next message
+TOKEN_REFRESH_ACTIVE_WINDOW = float(os.getenv('TOKEN_REFRESH_ACTIVE_WINDOW_SECONDS', '1800'))
+# A request only refreshes inline if the token is (almost) expired
+INLINE_REFRESH_MARGIN = 30
+
+
+def _load_client_secrets():
+    """client_id / client_secret are needed to refresh a token"""
+    try:
+        with open(CLIENT_SECRETS_FILE) as f:
+            secrets = json.load(f)
+        return secrets.get('web') or secrets.get('installed') or {}
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"Could not read client secrets for token refresh: {e}")
+        return {}
+
+
+def _parse_scopes(scopes):
+    """Scopes are stored as a JSON list (see /auth/callback)"""
+    if not scopes:
+        return None
+    if isinstance(scopes, str):
+        try:
+            return json.loads(scopes)
+        except json.JSONDecodeError:
+            return scopes.split()
+    return scopes
+
+
+def _parse_expiry(token_expiry):
+    """DB value (datetime or ISO string, UTC) -> naive UTC datetime, like google-auth uses"""
+    if token_expiry is None:
+        return None
+    if isinstance(token_expiry, str):
+        token_expiry = datetime.fromisoformat(token_expiry)
+    if token_expiry.tzinfo is not None:
+        token_expiry = token_expiry.replace(tzinfo=None) - token_expiry.utcoffset()
+    return token_expiry
+
+
+def _expires_within(creds, seconds):
+    if creds.expiry is None:
+        return False
+    return creds.expiry - timedelta(seconds=seconds) <= datetime.utcnow()
+
+
+class CredentialManager:
+    """
+    Keeps ready-to-use google Credentials per (user_id, service_name) in memory.
+    - get_credentials() is a cache lookup on the hot path
+    - concurrent refreshes of the same user's token collapse into one (singleflight)
+    - start() runs a background thread that refreshes tokens of recently active
+      users before they expire and persists them with save_user_google_creds
+    """
+
+    def __init__(self, refresh_ahead=TOKEN_REFRESH_AHEAD, interval=TOKEN_REFRESH_INTERVAL,
+                 active_window=TOKEN_REFRESH_ACTIVE_WINDOW):
+        self.refresh_ahead = refresh_ahead
+        self.interval = interval
+        self._cache = TTLCache(maxsize=CREDENTIAL_CACHE_SIZE, ttl=CREDENTIAL_CACHE_TTL)
+        # (user_id, service_name) this process used lately, see refresh_expiring
+        self._active = TTLCache(maxsize=CREDENTIAL_CACHE_SIZE, ttl=active_window)
+        self._client_secrets = None
+        self._key_lock = KeyedLock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.refreshes = 0
+        self.inline_refreshes = 0
+        self.refresh_failures = 0
+
+    def _credentials(self, access_token, refresh_token, scopes, token_expiry):
+        if self._client_secrets is None:
+            self._client_secrets = _load_client_secrets()
+        return Credentials(
+            token=access_token,
+            refresh_token=refresh_token,
+            token_uri=self._client_secrets.get('token_uri', TOKEN_URI),
+            client_id=self._client_secrets.get('client_id'),
+            client_secret=self._client_secrets.get('client_secret'),
+            scopes=_parse_scopes(scopes),
+            expiry=_parse_expiry(token_expiry),
+        )
+
+    def prime(self, user_id, creds_data, service_name='google_calendar'):
+        """
+        Seeds the cache from a credentials row we already have (e.g. begin_turn's),
+        so the tool calls of this turn need no DB query. Never overrides a cached entry.
+        """
+        if not creds_data:
+            return
+        self._active.set((user_id, service_name), True)
+        if self._cache.peek((user_id, service_name)) is not None:
+            return
+        self._cache.set((user_id, service_name), self._credentials(
+            creds_data['access_token'], creds_data['refresh_token'],
+            creds_data['scopes'], creds_data.get('token_expiry'),
+        ))
+
+    def forget(self, user_id, service_name='google_calendar'):
+        """Drop the cached entry, e.g. after the user logged in again"""
+        self._cache.pop((user_id, service_name))
+
+    def get_credentials(self, user_id, service_name='google_calendar'):
+        """Credentials for the user, or None if they never connected Google / refresh failed"""
+        key = (user_id, service_name)
+        self._active.set(key, True)
+        creds = self._cache.get(key)
+        if creds is not None and not _expires_within(creds, INLINE_REFRESH_MARGIN):
+            return creds
+
+        with self._key_lock(key):
+            # someone else may have loaded/refreshed it while we waited
+            creds = self._cache.peek(key)
+            if creds is not None and not _expires_within(creds, INLINE_REFRESH_MARGIN):
+                return creds
+
+            creds_data = get_user_google_creds(user_id, service_name)
+            if not creds_data:
+                return None
+            creds = self._credentials(
+                creds_data['access_token'], creds_data['refresh_token'],
+                creds_data['scopes'], creds_data.get('token_expiry'),
+            )
+            if creds.expiry is None or _expires_within(creds, INLINE_REFRESH_MARGIN):
+                # the background job missed it (new user, job not running...)
+                self.inline_refreshes += 1
+                creds = self._refresh_locked(user_id, service_name, creds)
+                if creds is None:
+                    return None
+            self._cache.set(key, creds)
+            return creds
+
+    def _refresh_locked(self, user_id, service_name, creds):
+        """Refreshes creds and saves them. Caller holds the key lock."""
+        if not creds.refresh_token:
+            print(f"No refresh token found for user {user_id} and service {service_name}.")
+            return None
+        try:
+            creds.refresh(Request())
+        except Exception as e:
+            self.refresh_failures += 1
+            print(f"Error refreshing token for user {user_id}: {e}")
+            return None
+
+        self.refreshes += 1
+        saved = save_user_google_creds(
+            user_id=user_id,
+            service_name=service_name,
+            access_token=creds.token,
+            refresh_token=creds.refresh_token,
+            token_expiry=creds.expiry.isoformat() if creds.expiry else None,
+            scopes=json.dumps(creds.scopes) if creds.scopes else None
+        )
+        if not saved:
+            print(f"Failed to save refreshed token for user {user_id} and service {service_name}.")
+        return creds
+
+    def refresh(self, user_id, service_name='google_calendar'):
+        """Forces a refresh from the stored refresh token. Returns the new Credentials or None."""
+        key = (user_id, service_name)
+        with self._key_lock(key):
+            creds_data = get_user_google_creds(user_id, service_name)
+            if not creds_data:
+                return None
+            creds = self._credentials(
+                creds_data['access_token'], creds_data['refresh_token'],
+                creds_data['scopes'], creds_data.get('token_expiry'),
+            )
+            creds = self._refresh_locked(user_id, service_name, creds)
+            if creds is not None:
+                self._cache.set(key, creds)
+            return creds
+
+    def refresh_expiring(self, service_name='google_calendar'):
+        """
+        One pass of the background job: refresh the tokens of recently active
+        users that expire within refresh_ahead. Inactive users are left alone,
+        so idle accounts aren't refreshed forever by every process.
+        """
+        active_users = [user_id for (user_id, name), _ in self._active.items() if name == service_name]
+        if not active_users:
+            return 0
+        refreshed = 0
+        for user_id, access_token, refresh_token, scopes, token_expiry in get_expiring_credentials(
+                self.refresh_ahead, service_name, user_ids=active_users):
+            if self._stop.is_set():
+                break
+            key = (user_id, service_name)
+            with self._key_lock(key):
+                cached = self._cache.peek(key)
+                if cached is not None and not _expires_within(cached, self.refresh_ahead):
+                    continue  # refreshed by a request in the meantime
+                creds = self._credentials(access_token, refresh_token, scopes, token_expiry)
+                creds = self._refresh_locked(user_id, service_name, creds)
+                if creds is not None:
+                    self._cache.set(key, creds)
+                    refreshed += 1
+        return refreshed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh_expiring()
+            except Exception as e:
+                print(f"Error in background token refresh: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="token-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self):
+        return {
+            "cache": self._cache.stats(),
+            "refreshes": self.refreshes,
+            "inline_refreshes": self.inline_refreshes,
+            "refresh_failures": self.refresh_failures,
+            "active_users": len(self._active),
+            "background_running": self._thread is not None and self._thread.is_alive(),
+        }
+
+
+credential_manager = CredentialManager()
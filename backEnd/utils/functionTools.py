@@ -58,6 +58,14 @@ list_calendar_events_function = {
                 "type": "string",
                 "description": "Name of the calendar to get all the events from.",
             },
+            "time_min": {
+                "type": "string",
+                "description": "Only events ending after this date or datetime (e.g., '2025-10-31'). Defaults to now.",
+            },
+            "time_max": {
+                "type": "string",
+                "description": "Only events starting before this date (inclusive) or datetime (e.g., '2025-11-07')",
+            },
         },
         "required": ["calendar_name"],
     },
@@ -72,4 +80,108 @@ list_calendar_list_function = {
     },
 }
 
+create_calendar_events_bulk_function = {
+    "name": "insert_calendar_events_bulk",
+    "description": (
+        "Creates several events in one Google Calendar at once. Use it instead of calling "
+        "insert_calendar_event many times, e.g. for recurring slots like 'standups Mon-Thu at 9'. "
+        "Returns which events were created and which failed."
+    ),
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "calendar_name": {
+                "type": "string",
+                "description": "The name of the calendar (e.g., 'Cal-work')",
+            },
+            "events": {
+                "type": "array",
+                "description": "The events to create",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "summary": {
+                            "type": "string",
+                            "description": "Title of the event (e.g., 'Standup')",
+                        },
+                        "start_datetime": {
+                            "type": "string",
+                            "description": "The start Date of the meeting (e.g., '2025-10-31T09:00:00+02:00')",
+                        },
+                        "end_datetime": {
+                            "type": "string",
+                            "description": "The end Date of the meeting (e.g., '2025-10-31T09:15:00+02:00')",
+                        },
+                        "description": {
+                            "type": "string",
+                            "description": "The description of the event",
+                        },
+                    },
+                    "required": ["summary", "start_datetime"],
+                },
+            },
+        },
+        "required": ["calendar_name", "events"],
+    },
+}
+
+find_free_slots_function = {
+    "name": "find_free_slots",
+    "description": (
+        "Finds free time across the user's calendars, e.g. to suggest when to schedule a meeting. "
+        "Returns free slots inside working hours that are at least duration_minutes long."
+    ),
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "time_min": {
+                "type": "string",
+                "description": "Start of the search range, a date or datetime (e.g., '2025-10-31' or '2025-10-31T12:00:00+02:00')",
+            },
+            "time_max": {
+                "type": "string",
+                "description": "End of the search range, a date (inclusive) or datetime (e.g., '2025-11-02')",
+            },
+            "duration_minutes": {
+                "type": "integer",
+                "description": "How long the meeting needs to be, in minutes (default 30)",
+            },
+            "work_start": {
+                "type": "string",
+                "description": "Start of the working day as HH:MM (default '09:00')",
+            },
+            "work_end": {
+                "type": "string",
+                "description": "End of the working day as HH:MM (default '18:00')",
+            },
+            "calendar_names": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Calendars to check. Leave empty to check all of the user's calendars.",
+            },
+        },
+        "required": ["time_min", "time_max"],
+    },
+}
 
+list_all_calendar_events_function = {
+    "name": "list_all_calendar_events",
+    "description": (
+        "Gets the events of ALL the user's calendars in a time range as one list ordered by start time. "
+        "Use it for questions like 'what do I have tomorrow?' instead of listing calendars one by one."
+    ),
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "time_min": {
+                "type": "string",
+                "description": "Start of the range, a date or datetime (e.g., '2025-10-31' or '2025-10-31T12:00:00+02:00')",
+            },
+            "time_max": {
+                "type": "string",
+                "description": "End of the range, a date (inclusive) or datetime (e.g., '2025-10-31')",
+            },
+        },
+        "required": ["time_min", "time_max"],
+    },
+}
@@ -0,0 +1,34 @@
+import threading
+from contextlib import contextmanager
+
+
+class KeyedLock:
+    """
+    One threading.Lock per key, e.g. per user: `with locks(key): ...`.
+    A key's lock only exists while someone holds or waits for it, so the
+    table doesn't grow with every user ever seen.
+    """
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, holders + waiters]
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def __call__(self, key):
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def __len__(self):
+        with self._guard:
+            return len(self._locks)
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache where every entry also expires after `ttl` seconds.
+    - maxsize: entries kept before the least recently used one is dropped
+    - ttl: seconds an entry lives (None = forever)
+    - sliding: if True the ttl restarts on every hit (idle timeout instead of max age)
+    Keeps hit/miss/eviction counters, see stats().
+    """
+
+    def __init__(self, maxsize=1024, ttl=600, sliding=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sliding = sliding
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expires_at(self):
+        return None if self.ttl is None else time.monotonic() + self.ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            if self.sliding:
+                self._data[key] = (value, self._expires_at())
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """Like get() but doesn't count, reorder or extend the entry."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or (entry[1] is not None and entry[1] <= time.monotonic()):
+                return default
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, self._expires_at())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+            return default if entry is _MISSING else entry[0]
+
+    def invalidate_where(self, predicate):
+        """Drops every entry where predicate(key, value) is true. Returns how many were dropped."""
+        with self._lock:
+            doomed = [key for key, (value, _) in self._data.items() if predicate(key, value)]
+            for key in doomed:
+                del self._data[key]
+            return len(doomed)
+
+    def items(self):
+        """Snapshot of the live (key, value) pairs, oldest first. Does not touch the counters."""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (value, expires_at) in self._data.items()
+                    if expires_at is None or expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }